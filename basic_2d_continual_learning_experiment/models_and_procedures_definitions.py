@@ -1,7 +1,10 @@
+import multiprocessing
 import numpy as np
 import os
 import pandas as pd
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import scipy.sparse
+import scipy.sparse.linalg
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
@@ -12,7 +15,9 @@ from tensorflow.keras.layers.experimental.preprocessing import Rescaling
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 
 import random
+import matplotlib
 import matplotlib.pyplot as plt
+from matplotlib.lines import Line2D
 import numpy as np
 
 # Define the target function
@@ -33,49 +38,85 @@ def create_partitions(n_partitions):
 
     return partitions
 
-def generate_training_data(partitions, n_samples):
-    # Create a list to store all training data and labels
-    all_X_train = []
-    all_y_train = []
+def sine_product(X: np.ndarray) -> np.ndarray:
+    """Target function for any input dimension, the product of sin(4 pi x_i); equals f in 2D."""
+    return np.prod(np.sin(4 * np.pi * X), axis=-1)
 
-    # For each partition generate training points and train all models on them
-    for idx, ((x1_min, x1_max), (x2_min, x2_max)) in enumerate(partitions):
-        # Generate training data within the current partition and evaluate the function at these points
-        X_train_partition = np.random.uniform([x1_min, x2_min], [x1_max, x2_max], (n_samples, 2))
-        y_train_partition = f(X_train_partition[:, 0], X_train_partition[:, 1])
+def create_partition_grid(partition_counts, input_dim: int = None, rng=np.random) -> np.ndarray:
+    '''
+    Create the shuffled partitions of [0, 1]^input_dim into a grid of equally sized cells.
 
-        # Append the current partition's data to all_X_train and all_y_train 
-        all_X_train.append(X_train_partition)
-        all_y_train.append(y_train_partition)
+    Args:
+    - partition_counts (int or list): Partitions per dimension, either one count for every dimension or one per dimension.
+    - input_dim (int): The input dimension, only needed when partition_counts is a single int.
+    - rng: np.random (the default) or a np.random.Generator, used for the shuffle.
 
-    # Concatenate all training data and labels into numpy arrays
-    all_X_train = np.concatenate(all_X_train, axis=0)
-    all_y_train = np.concatenate(all_y_train, axis=0)
+    Returns:
+    - np.ndarray: The cells in random order, shape [n_cells, input_dim, 2], with the (min, max) of every dimension.
+    '''
+    partition_counts = np.broadcast_to(partition_counts, (input_dim,) if np.ndim(partition_counts) == 0 else np.shape(partition_counts))
+    # Cell coordinates of every cell, with the first dimension varying slowest as in create_partitions.
+    cells = np.stack(np.meshgrid(*[np.arange(count) for count in partition_counts], indexing='ij'), axis=-1).reshape(-1, len(partition_counts))
+    partitions = np.stack([cells / partition_counts, (cells + 1) / partition_counts], axis=-1)
+    return partitions[rng.permutation(len(partitions))]
 
-    return all_X_train, all_y_train
+def stream_partitioned_tasks(partitions, n_samples: int, target_function=sine_product, rng=np.random, tasks_per_batch: int = 1):
+    '''
+    Lazily generate the training data of the partitions, tasks_per_batch partitions at a time.
 
-def plot_training_data(partitions,X,y,n_samples, plot_name='', save=False):
-    
-    n_partitions = 4
+    Args:
+    - partitions (array-like): Partitions of shape [n_cells, input_dim, 2], e.g. from create_partition_grid or create_partitions.
+    - n_samples (int): Number of uniform samples per partition.
+    - target_function: Maps inputs of shape [n, input_dim] to targets. Defaults to sine_product.
+    - rng: np.random (the default) or a np.random.Generator.
+    - tasks_per_batch (int): Number of partitions per yielded batch. Defaults to 1.
+
+    Yields:
+    - tuple: The inputs, shape [tasks_per_batch*n_samples, input_dim], and their targets.
+    '''
+    partitions = np.asarray(partitions, dtype=np.float64)
+    for start in range(0, len(partitions), tasks_per_batch):
+        batch = partitions[start:start + tasks_per_batch]
+        # One draw for all partitions of the batch, in the same order as one draw per partition.
+        X = rng.uniform(batch[:, np.newaxis, :, 0], batch[:, np.newaxis, :, 1],
+                        (len(batch), n_samples, batch.shape[1])).reshape(-1, batch.shape[1])
+        yield X, target_function(X)
+
+def generate_partitioned_data(partitions, n_samples: int, target_function=sine_product, rng=np.random) -> tuple:
+    """Generate the training data of all partitions with one vectorized draw, ordered partition by partition."""
+    partitions = np.asarray(partitions, dtype=np.float64)
+    return next(stream_partitioned_tasks(partitions, n_samples, target_function, rng, tasks_per_batch=max(len(partitions), 1)))
+
+def generate_training_data(partitions, n_samples):
+    # All partitions are sampled in one call, drawing the same random numbers as one call per partition did.
+    return generate_partitioned_data(partitions, n_samples, lambda X: f(X[:, 0], X[:, 1]))
 
-    values = np.linspace(0, 1, n_partitions**2)
-    colormap = plt.cm.viridis
-    colors = colormap(values)
+def draw_training_data(ax, partitions, X, n_samples):
+    """Draw the training data of all partitions in one scatter, coloured per partition, and label the partitions."""
+    partitions = np.asarray(partitions)
+    colors = plt.cm.viridis(np.linspace(0, 1, len(partitions)))
+    point_colors = np.repeat(colors, n_samples, axis=0)[:len(X)]
 
-    fig, ax = plt.subplots()
     ax.set_xlim(0, 1)
     ax.set_ylim(0, 1)
+    ax.scatter(X[:, 0], X[:, 1], c=point_colors, alpha=0.82, s=10.)
 
-    for idx in range(len(partitions)):
-        # Plot the sampled points for visual confirmation
-        ax.scatter(X[idx*n_samples:(idx+1)*n_samples, 0], X[idx*n_samples:(idx+1)*n_samples, 1], color=colors[idx % len(colors)], alpha=0.82, s=10., label='Partition '+str(idx+1))
-        ax.text((partitions[idx][0][0]+partitions[idx][0][1])/2,(partitions[idx][1][0]+partitions[idx][1][1])/2,str(idx+1), color='black',ha='center',va='center',weight='bold', fontsize=12,bbox=dict(facecolor='white', edgecolor='none'))
+    centres = partitions.mean(axis=-1)
+    for idx, (x1, x2) in enumerate(centres):
+        ax.text(x1, x2, str(idx+1), color='black',ha='center',va='center',weight='bold', fontsize=12,bbox=dict(facecolor='white', edgecolor='none'))
 
     ax.set_xlabel('$x_1$') 
     ax.set_ylabel('$x_2$')
 
-    # Place a legend to the right of this smaller subplot.
-    plt.legend(bbox_to_anchor=(1.05, 1), loc='upper left')
+    # Proxy handles give the legend one entry per partition.
+    handles = [Line2D([], [], marker='o', linestyle='', color=color, alpha=0.82, label='Partition '+str(idx+1))
+               for idx, color in enumerate(colors)]
+    ax.legend(handles=handles, bbox_to_anchor=(1.05, 1), loc='upper left')
+
+def plot_training_data(partitions,X,y,n_samples, plot_name='', save=False):
+    
+    fig, ax = plt.subplots()
+    draw_training_data(ax, partitions, X, n_samples)
 
     if save:
         plt.savefig(f'{plot_name}.png', dpi=300, bbox_inches='tight')
@@ -107,13 +148,101 @@ def predict_models(model_list):
 
     return all_pred
 
-def plot_predictions(model_list, predictions, plot_name='', save=False):
-    fig, axs = plt.subplots(1, len(model_list), figsize=(len(model_list)*3, 5), sharex=True, sharey=True)
+def _grid_dependencies(model, X_test):
+    """Return the tables a local model's grid predictions depend on and a CSC matrix with a non-zero where
+    grid point i depends on row j of the stacked tables, or None for models without local support."""
+    if isinstance(model, LookupTableModel):
+        cells = model.cell_indices(tf.constant(X_test, dtype=tf.float32)).numpy()
+        table = model.embedding.embeddings
+        dependencies = scipy.sparse.csc_matrix((np.ones(len(cells)), (np.arange(len(cells)), cells)),
+                                               shape=(len(cells), table.shape[0]))
+        return [table], dependencies
+    if isinstance(model, SplineANN):
+        return [model.control_points.embeddings], model.design_matrix(X_test).tocsc()
+    if isinstance(model, ABELSpline):
+        spline_anns = [model.direct_sam] + ([model.indirect_sam] if model.num_exps > 0 else [])
+        # A grid point's output only depends on its own control points in both SAMs.
+        return ([spline_ann.control_points.embeddings for spline_ann in spline_anns],
+                scipy.sparse.hstack([spline_ann.design_matrix(X_test) for spline_ann in spline_anns]).tocsc())
+    return None, None
+
+class IncrementalGridEvaluator:
+    """
+    Prediction grid of predict_models that is kept up to date by re-evaluating only what changed.
+
+    For LookupTableModel, SplineANN and ABELSpline, the rows of the control point tables that changed since
+    the last evaluation are found by comparing against a snapshot, and only the grid points whose support
+    includes a changed row are re-evaluated. Dense models are fully re-evaluated. This makes it cheap to
+    record forgetting after every partition or epoch.
+
+    Attributes:
+    - grid_size (int): The number of grid points per axis.
+    - X_test (np.ndarray): The grid points, ordered as in predict_models.
+    - predictions (list): The current prediction grids, one [grid_size, grid_size] array per model.
+    - evaluated_points (list): The number of grid points evaluated per model by the last update.
+    """
+    def __init__(self, model_list, grid_size: int = 100):
+        self.model_list = model_list
+        self.grid_size = grid_size
+        X1, X2 = np.meshgrid(np.linspace(0, 1, grid_size), np.linspace(0, 1, grid_size))
+        self.X_test = np.stack([X1.flatten(), X2.flatten()]).T.astype(np.float32)
+        self.predictions = []
+        self.evaluated_points = []
+        self._dependencies = []
+        self._snapshots = []
+        for model, name in model_list:
+            if not model.built:
+                model(tf.constant(self.X_test[:1]))
+            self._dependencies.append(_grid_dependencies(model, self.X_test))
+            self._snapshots.append(None)
+            self.predictions.append(None)
+        self.update()
+
+    def _evaluate(self, model, points: np.ndarray, batch_size: int = 10000) -> np.ndarray:
+        return np.concatenate([model(tf.constant(points[start:start + batch_size])).numpy().reshape(-1)
+                               for start in range(0, len(points), batch_size)])
+
+    def update(self) -> list:
+        """Bring the prediction grids up to date with the models and return them."""
+        self.evaluated_points = []
+        for index, (model, name) in enumerate(self.model_list):
+            tables, dependencies = self._dependencies[index]
+            if tables is None or self.predictions[index] is None:
+                flat_predictions = self._evaluate(model, self.X_test)
+                self.evaluated_points.append(len(self.X_test))
+            else:
+                current = [table.numpy() for table in tables]
+                changed_rows = np.concatenate([np.any(now != before, axis=1) for now, before in zip(current, self._snapshots[index])])
+                affected = np.flatnonzero(dependencies[:, np.flatnonzero(changed_rows)].getnnz(axis=1))
+                flat_predictions = self.predictions[index].reshape(-1).copy()
+                if len(affected) > 0:
+                    flat_predictions[affected] = self._evaluate(model, self.X_test[affected])
+                self.evaluated_points.append(len(affected))
+            if tables is not None:
+                self._snapshots[index] = [table.numpy() for table in tables]
+            self.predictions[index] = flat_predictions.reshape(self.grid_size, self.grid_size)
+        return self.predictions
+
+    def partition_errors(self, partitions) -> np.ndarray:
+        """Return the mean absolute error of every model's grid on every partition, shape [n_models, n_partitions]."""
+        targets = f(self.X_test[:, 0], self.X_test[:, 1])
+        errors = np.zeros((len(self.model_list), len(partitions)))
+        for j, ((x1_min, x1_max), (x2_min, x2_max)) in enumerate(partitions):
+            inside = ((self.X_test[:, 0] >= x1_min) & (self.X_test[:, 0] <= x1_max) &
+                      (self.X_test[:, 1] >= x2_min) & (self.X_test[:, 1] <= x2_max))
+            for i, predictions in enumerate(self.predictions):
+                errors[i, j] = np.mean(np.abs(predictions.reshape(-1)[inside] - targets[inside]))
+        return errors
+
+def draw_predictions(names, predictions):
+    """Draw the prediction grids of all models side by side with a shared colorbar and return the figure."""
+    fig, axs = plt.subplots(1, len(names), figsize=(len(names)*3, 5), sharex=True, sharey=True)
+    axs = np.atleast_1d(axs)
     
     vmin = -1.0 #min([pred.min() for pred in predictions])
     vmax = +1.0 #max([pred.max() for pred in predictions])
 
-    for (model, name), ax, Z_pred in zip(model_list, axs.flatten(), predictions):
+    for name, ax, Z_pred in zip(names, axs.flatten(), predictions):
     
         # Plot the predicted function using imshow with shared color limits
         im = ax.imshow(Z_pred, extent=[0, 1, 0 ,1], origin='lower', cmap='viridis', vmin=vmin,vmax=vmax)
@@ -135,6 +264,10 @@ def plot_predictions(model_list, predictions, plot_name='', save=False):
     fig.colorbar(im, cax=cax)
 
     plt.tight_layout()
+    return fig
+
+def plot_predictions(model_list, predictions, plot_name='', save=False):
+    draw_predictions([name for model, name in model_list], predictions)
     
     if save:
         plt.savefig(f'{plot_name}.png', dpi=300, bbox_inches='tight')
@@ -142,6 +275,53 @@ def plot_predictions(model_list, predictions, plot_name='', save=False):
     else:
         plt.show()
 
+def cache_training_data(path, partitions, X, y, n_samples):
+    """Store the partitions and training data needed by render_training_data in a .npz file."""
+    np.savez(path, partitions=np.asarray(partitions), X=X, y=y, n_samples=n_samples)
+
+def cache_predictions(path, model_list, predictions):
+    """Store the model names and prediction grids needed by render_predictions in a .npz file."""
+    np.savez(path, names=np.array([name for model, name in model_list]), predictions=np.stack(predictions))
+
+def render_training_data(cache_path, plot_name, dpi=300):
+    """Render a training data figure from a cache written by cache_training_data."""
+    data = np.load(cache_path)
+    fig, ax = plt.subplots()
+    draw_training_data(ax, data['partitions'], data['X'], int(data['n_samples']))
+    fig.savefig(f'{plot_name}.png', dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return plot_name
+
+def render_predictions(cache_path, plot_name, dpi=300):
+    """Render a predictions figure from a cache written by cache_predictions."""
+    data = np.load(cache_path)
+    fig = draw_predictions(list(data['names']), data['predictions'])
+    fig.savefig(f'{plot_name}.png', dpi=dpi, bbox_inches='tight')
+    plt.close(fig)
+    return plot_name
+
+def _use_non_interactive_backend():
+    matplotlib.use('Agg', force=True)
+
+def render_figures_parallel(jobs: list, max_workers: int = None) -> list:
+    '''
+    Render many figures concurrently in worker processes using the non-interactive Agg backend.
+
+    Args:
+    - jobs (list): (render_function, cache_path, plot_name) tuples, where render_function is
+      render_training_data, render_predictions or another module level function with that signature.
+    - max_workers (int): Number of worker processes, defaults to the number of CPUs.
+
+    Returns:
+    - list: The names of the rendered plots, in the order of jobs.
+    '''
+    # TensorFlow is already initialized here and is not fork-safe, so the workers are started fresh.
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_use_non_interactive_backend) as executor:
+        futures = [executor.submit(render_function, cache_path, plot_name)
+                   for render_function, cache_path, plot_name in jobs]
+        return [future.result() for future in futures]
+
 def pseudorehearsal(input_dim: int, num_samples: int, 
                     model: tf.keras.Model, 
                     train_x: np.ndarray, 
@@ -182,34 +362,43 @@ def pseudorehearsal(input_dim: int, num_samples: int,
 
     return shuffled_x, shuffled_y
 
-def initialize_all_models(input_dimension: int, 
-                          seed_val: int, 
-                          output_dim: int = 1,
-                          hidden_units_wide: int = 1000,
-                          hidden_units_deep: int = 16,
-                          hidden_layers: int = 8,
-                          num_exps: int = 6) -> list:
-    """Initialize models with given configurations."""
+def _model_builders(input_dimension: int,
+                    output_dim: int = 1,
+                    hidden_units_wide: int = 1000,
+                    hidden_units_deep: int = 16,
+                    hidden_layers: int = 8,
+                    num_exps: int = 6) -> list:
+    """Return (name, builder) pairs in the order of initialize_all_models, where builder(seed) constructs the model."""
     common_args = {
         'input_dim': input_dimension, 
-        'output_dim': output_dim, 
-        'seed': seed_val
+        'output_dim': output_dim
     }
 
-    models = [
-        (create_wide_relu_ann(hidden_units=hidden_units_wide, **common_args), "Wide ReLU ANN"),
-        (create_deep_relu_ann(hidden_units=hidden_units_deep, hidden_layers=hidden_layers, **common_args), "Deep ReLU ANN"),
+    builders = [
+        ("Wide ReLU ANN", lambda seed: create_wide_relu_ann(hidden_units=hidden_units_wide, seed=seed, **common_args)),
+        ("Deep ReLU ANN", lambda seed: create_deep_relu_ann(hidden_units=hidden_units_deep, hidden_layers=hidden_layers, seed=seed, **common_args)),
     ]
 
     for partition_num in [20]:
-        models.append((SplineANN(partition_num=partition_num, **common_args), 
-                       f"Spline ANN (z={partition_num})"))
-        models.append((ABELSpline(partition_num=partition_num, num_exps=num_exps, **common_args), 
-                       f"ABEL-Spline (z={partition_num})"))
-        models.append((LookupTableModel(partition_num=partition_num, default_val=-1., **common_args),
-                       f"Lookup Table (z={partition_num})"))
+        builders.append((f"Spline ANN (z={partition_num})",
+                         lambda seed, partition_num=partition_num: SplineANN(partition_num=partition_num, seed=seed, **common_args)))
+        builders.append((f"ABEL-Spline (z={partition_num})",
+                         lambda seed, partition_num=partition_num: ABELSpline(partition_num=partition_num, num_exps=num_exps, seed=seed, **common_args)))
+        builders.append((f"Lookup Table (z={partition_num})",
+                         lambda seed, partition_num=partition_num: LookupTableModel(partition_num=partition_num, default_val=-1., seed=seed, **common_args)))
 
-    return models
+    return builders
+
+def initialize_all_models(input_dimension: int, 
+                          seed_val: int, 
+                          output_dim: int = 1,
+                          hidden_units_wide: int = 1000,
+                          hidden_units_deep: int = 16,
+                          hidden_layers: int = 8,
+                          num_exps: int = 6) -> list:
+    """Initialize models with given configurations."""
+    builders = _model_builders(input_dimension, output_dim, hidden_units_wide, hidden_units_deep, hidden_layers, num_exps)
+    return [(build(seed_val), name) for name, build in builders]
 
 def compile_models(models, optimizer='adam', loss='mean_absolute_error'):
     """Compile TensorFlow/Keras models."""
@@ -296,7 +485,7 @@ class LookupTableModel(tf.keras.Model):
         # Changed to integer type
         self.partition_num_powers = tf.cast(tf.pow(partition_num, tf.range(input_dim)), dtype=tf.int32)
 
-    def call(self, inputs: tf.Tensor) -> tf.Tensor:
+    def cell_indices(self, inputs: tf.Tensor) -> tf.Tensor:
         # ReLU operation to drop negative inputs 
         inputs = tf.maximum(0., inputs)
 
@@ -308,9 +497,10 @@ class LookupTableModel(tf.keras.Model):
 
         # Flatten each vector to get a single index for each sample.
         indices = tf.reduce_sum(bounded_inputs * self.partition_num_powers, axis=1)
+        return indices
 
-        
-        outputs = self.embedding(indices)
+    def call(self, inputs: tf.Tensor) -> tf.Tensor:
+        outputs = self.embedding(self.cell_indices(inputs))
         return outputs
 
 class ABELSpline(keras.Model):
@@ -358,7 +548,7 @@ class ABELSpline(keras.Model):
         if self.num_exps > 0:
             spline_additive_output = self.indirect_sam(inputs)
             output_anti_symmetric_exponential = self.anti_symmetric_exponential_layer(spline_additive_output)
-            output_accumulator = tf.keras.layers.Add()([output_accumulator, output_anti_symmetric_exponential])
+            output_accumulator = output_accumulator + output_anti_symmetric_exponential
         
         return output_accumulator
 
@@ -397,7 +587,7 @@ class AntiSymmetricExponential(tf.keras.layers.Layer):
         exponentials = tf.math.exp(add_bias)
         summed = tf.reduce_sum(exponentials,axis=-1 ,keepdims=False)
         list_of_exponentials = tf.split(summed,num_or_size_splits=2,axis=-1)
-        difference = tf.keras.layers.subtract(list_of_exponentials)
+        difference = list_of_exponentials[0] - list_of_exponentials[1]
         output = self.reshape_output(difference)
         
         return output
@@ -442,17 +632,45 @@ class SplineANN(keras.Model):
         self.control_points = self._create_control_points(seed)
 
     def call(self, input_tensor: tf.Tensor, training: bool = False) -> tf.Tensor:
-        reshaped_input = self.reshape_input(input_tensor)
-        spline_values = self.reshape_splines(self.cubic_spline(self.scale_floormod(reshaped_input)))
+        spline_values, control_point_indices = self.spline_basis(input_tensor)
         #transposed_splines = tf.transpose(self.repeat_splines(spline_values), perm=[0, 2, 1])
         transposed_splines = tf.transpose(self.repeat_splines(spline_values), perm=[0, 2, 1])
+        control_points_values = self.control_points(control_point_indices)
+        #print(control_points_values.shape)
+        #return tf.math.reduce_sum(Multiply()([transposed_splines,control_points_values]),1, keepdims=False)
+        return tf.math.reduce_sum(transposed_splines * control_points_values, -2, keepdims=False)
+
+    def spline_basis(self, input_tensor: tf.Tensor) -> tuple:
+        """Compute the non-zero cubic spline values of each input and the control points they weigh.
+
+        :param input_tensor: Input tensor of shape [batch, input_dim]
+        :return: Spline values (float32) and control point indices (int32), both of shape [batch, 4*input_dim]
+        """
+        reshaped_input = self.reshape_input(input_tensor)
+        spline_values = self.reshape_splines(self.cubic_spline(self.scale_floormod(reshaped_input)))
         floor_shift_values = self.reshape_ints(self.floor_shift(reshaped_input)) 
         floor_div_values = tf.math.floormod(floor_shift_values, self.density)
         adjusted_input_dim_values = tf.nn.bias_add(floor_div_values, self.input_dimension_shift)
-        control_points_values = self.control_points(adjusted_input_dim_values)
-        #print(control_points_values.shape)
-        #return tf.math.reduce_sum(Multiply()([transposed_splines,control_points_values]),1, keepdims=False)
-        return tf.math.reduce_sum(Multiply()([transposed_splines,control_points_values]),-2, keepdims=False)
+        return spline_values, tf.cast(adjusted_input_dim_values, dtype=tf.int32)
+
+    def design_matrix(self, inputs: np.ndarray, batch_size: int = 10000) -> scipy.sparse.csr_matrix:
+        """Assemble the sparse design matrix of the inputs, with one column per control point row.
+
+        Row i holds the 4*input_dim non-zero spline values of inputs[i], so that
+        model(inputs)[:, j] equals design_matrix(inputs) @ control_points[:, j].
+
+        :param inputs: Input array of shape [n, input_dim]
+        :param batch_size: Number of inputs passed through spline_basis at once
+        :return: Sparse matrix of shape [n, input_dim * density]
+        """
+        blocks = []
+        for start in range(0, len(inputs), batch_size):
+            spline_values, indices = self.spline_basis(tf.constant(inputs[start:start + batch_size], dtype=tf.float32))
+            num_rows, row_length = indices.shape
+            indptr = np.arange(0, num_rows * row_length + 1, row_length)
+            blocks.append(scipy.sparse.csr_matrix((spline_values.numpy().ravel(), indices.numpy().ravel(), indptr),
+                                                  shape=(num_rows, self.input_dim * self.density)))
+        return scipy.sparse.vstack(blocks, format='csr')
 
     def _create_control_points(self, seed : int) -> Embedding:
         return Embedding(self.input_dim * self.density, 
@@ -544,3 +762,154 @@ class SplineANN(keras.Model):
         del knots, density
         new_model.control_points.set_weights([new_weights])
         return new_model
+
+
+class RecursiveLeastSquares:
+    """
+    Exact online least-squares fitting of a SplineANN, or the direct SAM of an ABELSpline, across tasks.
+
+    The sufficient statistics X^T X (sparse) and X^T y are accumulated over all tasks seen so far, so
+    after each update the control points minimize the squared error over every task at once. Nothing
+    is forgotten and no rehearsal is needed, and an update only costs a pass over the new task's data
+    plus a sparse solve whose size is fixed by the number of control points.
+    """
+    def __init__(self, model: keras.Model, l2: float = 1e-6):
+        """
+        Initialize the sufficient statistics.
+
+        :param model: A SplineANN, or an ABELSpline whose direct SAM is fitted to the residual of its
+                      (fixed) anti-symmetric exponential part
+        :param l2: Ridge penalty, keeps the control points of unvisited partitions determined
+        """
+        self.model = model
+        self.spline_ann = model.direct_sam if isinstance(model, ABELSpline) else model
+        num_control_points = self.spline_ann.input_dim * self.spline_ann.density
+        self.l2 = l2
+        self.gram = scipy.sparse.csc_matrix((num_control_points, num_control_points))
+        self.moments = np.zeros((num_control_points, self.spline_ann.output_dim))
+
+    def update(self, inputs: np.ndarray, targets: np.ndarray) -> keras.Model:
+        """
+        Add a task's data to the statistics and solve for the control points.
+
+        :param inputs: Input array of shape [n, input_dim]
+        :param targets: Target array of shape [n] or [n, output_dim]
+        :return: The model, with the control points of its SplineANN replaced
+        """
+        targets = np.reshape(targets, (len(inputs), self.spline_ann.output_dim)).astype(np.float64)
+        if self.spline_ann is not self.model:
+            inputs_tensor = tf.constant(inputs, dtype=tf.float32)
+            targets = targets - (self.model(inputs_tensor) - self.spline_ann(inputs_tensor)).numpy()
+        design = self.spline_ann.design_matrix(inputs).astype(np.float64)
+        self.gram = self.gram + (design.T @ design).tocsc()
+        self.moments += design.T @ targets
+
+        normal_matrix = self.gram + self.l2 * scipy.sparse.identity(self.gram.shape[0], format='csc')
+        control_points = scipy.sparse.linalg.spsolve(normal_matrix, self.moments)
+        if not self.spline_ann.built:
+            self.spline_ann.build(input_shape=(None, self.spline_ann.input_dim))
+        self.spline_ann.control_points.set_weights([np.reshape(control_points, (-1, self.spline_ann.output_dim)).astype(np.float32)])
+        return self.model
+
+def _continual_learning_worker(connection, model_index: int, input_dimension: int, seed_val: int, epochs: int,
+                               batch_size: int, num_pseudorehearsal_samples: int, threads: int):
+    """Own one model of initialize_all_models in a worker process and train it on the tasks sent by the driver."""
+    try:
+        if threads is not None:
+            tf.config.threading.set_intra_op_parallelism_threads(threads)
+            tf.config.threading.set_inter_op_parallelism_threads(threads)
+        # Only this worker's model is constructed.
+        name, build = _model_builders(input_dimension)[model_index]
+        models = [(build(seed_val), name)]
+        compile_models(models)
+        model, name = models[0]
+        evaluator = IncrementalGridEvaluator(models)
+        connection.send(('ready', name))
+        while (message := connection.recv()) is not None:
+            X_train, y_train = message
+            if num_pseudorehearsal_samples > 0:
+                X_train, y_train = pseudorehearsal(input_dimension, num_pseudorehearsal_samples, model,
+                                                   X_train, np.reshape(y_train, (len(y_train), 1)), seed_val=0)
+            history = model.fit(X_train, y_train, epochs=epochs, batch_size=batch_size, verbose=0)
+            connection.send(('done', history.history['loss'], evaluator.update()[0]))
+    except Exception:
+        import traceback
+        connection.send(('error', traceback.format_exc()))
+    finally:
+        connection.close()
+
+def train_continual_learning_parallel(partition_input_training: list,
+                                      partition_target_training: list,
+                                      input_dimension: int = 2,
+                                      seed_val: int = 1,
+                                      epochs: int = 100,
+                                      batch_size: int = 100,
+                                      num_pseudorehearsal_samples: int = 0,
+                                      threads_per_model: int = None) -> dict:
+    '''
+    Train every model of initialize_all_models on the partitions in order, with the models training
+    concurrently, each in its own worker process.
+
+    Each model sees the tasks strictly in sequence, exactly as in the notebook loops. The workers only
+    synchronize at partition boundaries, where each returns its training history and its prediction grid,
+    so the wall time is bounded by the slowest model rather than the sum of all. Pseudorehearsal samples
+    are generated by each worker from its own model.
+
+    Args:
+    - partition_input_training (list): The input arrays of the tasks, in training order.
+    - partition_target_training (list): The target arrays of the tasks, in training order.
+    - input_dimension (int): Input dimension of the models. Defaults to 2.
+    - seed_val (int): Seed passed to initialize_all_models. Defaults to 1.
+    - epochs (int): Epochs per task. Defaults to 100.
+    - batch_size (int): Batch size. Defaults to 100.
+    - num_pseudorehearsal_samples (int): Pseudorehearsal samples per task, 0 disables it. Defaults to 0.
+    - threads_per_model (int): TensorFlow intra- and inter-op threads per worker. Defaults to an even
+      share of the CPUs, so the workers together do not oversubscribe them.
+
+    Returns:
+    - dict: 'names' (list of model names), 'histories' (per model, the loss history of every task) and
+      'predictions' (per model, the prediction grid after every task, as from predict_models).
+    '''
+    # TensorFlow is not fork-safe, so the workers are started fresh.
+    context = multiprocessing.get_context('spawn')
+    num_models = len(_model_builders(input_dimension))
+    if threads_per_model is None:
+        threads_per_model = max((os.cpu_count() or 1) // num_models, 1)
+    connections, workers = [], []
+    for model_index in range(num_models):
+        driver_connection, worker_connection = context.Pipe()
+        worker = context.Process(target=_continual_learning_worker,
+                                 args=(worker_connection, model_index, input_dimension, seed_val, epochs,
+                                       batch_size, num_pseudorehearsal_samples, threads_per_model))
+        worker.start()
+        worker_connection.close()
+        connections.append(driver_connection)
+        workers.append(worker)
+
+    def receive(connection):
+        message = connection.recv()
+        if message[0] == 'error':
+            raise RuntimeError(f"Continual learning worker failed:\n{message[1]}")
+        return message[1:]
+
+    try:
+        names = [receive(connection)[0] for connection in connections]
+        histories = [[] for _ in names]
+        predictions = [[] for _ in names]
+        for X_train, y_train in zip(partition_input_training, partition_target_training):
+            for connection in connections:
+                connection.send((X_train, y_train))
+            # Partition boundary: wait for every model before handing out the next task.
+            for index, connection in enumerate(connections):
+                history, grid = receive(connection)
+                histories[index].append(history)
+                predictions[index].append(grid)
+        return {'names': names, 'histories': histories, 'predictions': predictions}
+    finally:
+        for connection in connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        for worker in workers:
+            worker.join()
@@ -1,8 +1,17 @@
+import contextlib
+import hashlib
+import json
 import numpy as np
 import os
+import tempfile
+import threading
+import time
 import pandas as pd
 from concurrent.futures import ThreadPoolExecutor
 import pmlb
+from sklearn.metrics import mean_squared_error
+import scipy.sparse
+import scipy.sparse.linalg
 import tensorflow as tf
 from tensorflow import keras
 from tensorflow.keras import layers
@@ -10,13 +19,8 @@ from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import Conv1D, Embedding, Reshape, RepeatVector, Multiply, Dense
 from tensorflow.keras.layers.experimental.preprocessing import Rescaling
 
-def fetch_return_filtered_pmlb_data_sets():
-    
-    def fetch_dataset(row):
-        dataset_name = row[1]['dataset']
-        data = pmlb.fetch_data(dataset_name)
-        return data
-
+def filter_pmlb_metadata() -> pd.DataFrame:
+    """Return the metadata rows of the PMLB regression datasets used in the benchmark, without fetching any data."""
     metadata_path = os.path.join(os.path.dirname(pmlb.__file__), 'all_summary_stats.tsv')
     metadata = pd.read_csv(metadata_path, sep='\t')
 
@@ -30,12 +34,51 @@ def fetch_return_filtered_pmlb_data_sets():
         (metadata['endpoint_type'] == 'continuous') &
         (metadata['task'] == 'regression')
     ]
+    return filtered_datasets
+
+def fetch_return_filtered_pmlb_data_sets():
+    
+    def fetch_dataset(row):
+        dataset_name = row[1]['dataset']
+        data = pmlb.fetch_data(dataset_name)
+        return data
+
+    filtered_datasets = filter_pmlb_metadata()
     
     with ThreadPoolExecutor() as executor:
         datasets = list(executor.map(fetch_dataset, filtered_datasets.iterrows()))
     
     return (filtered_datasets, datasets)
 
+def _model_builders(input_dimension: int,
+                    output_dim: int = 1,
+                    hidden_units_wide: int = 1000,
+                    hidden_units_deep: int = 16,
+                    hidden_layers: int = 8,
+                    num_exps: int = 6) -> list:
+    """Return (name, builder) pairs in the order of initialize_all_models, where builder(seed) constructs the model."""
+    common_args = {
+        'input_dim': input_dimension, 
+        'output_dim': output_dim
+    }
+
+    builders = [
+        ("Linear Model", lambda seed: create_linear_model(seed=seed, **common_args)),
+        ("Wide ReLU ANN", lambda seed: create_wide_relu_ann(hidden_units=hidden_units_wide, seed=seed, **common_args)),
+        ("Deep ReLU ANN", lambda seed: create_deep_relu_ann(hidden_units=hidden_units_deep, hidden_layers=hidden_layers, seed=seed, **common_args)),
+        ("One Parameter", lambda seed: LookupTableModel(partition_num=1, default_val=-1., seed=seed, **common_args))
+    ]
+
+    for partition_num in [1,2,4,8,10]:
+        builders.append((f"Spline ANN (z={partition_num})",
+                         lambda seed, partition_num=partition_num: SplineANN(partition_num=partition_num, seed=seed, **common_args)))
+        builders.append((f"Lookup Table (z={partition_num})",
+                         lambda seed, partition_num=partition_num: LookupTableModel(partition_num=partition_num, default_val=-1., seed=seed, **common_args)))
+        builders.append((f"ABEL-Spline (z={partition_num})",
+                         lambda seed, partition_num=partition_num: ABELSpline(partition_num=partition_num, num_exps=num_exps, seed=seed, **common_args)))
+
+    return builders
+
 def initialize_all_models(input_dimension: int, 
                           seed_val: int, 
                           output_dim: int = 1,
@@ -44,28 +87,86 @@ def initialize_all_models(input_dimension: int,
                           hidden_layers: int = 8,
                           num_exps: int = 6) -> list:
     """Initialize models with given configurations."""
-    common_args = {
-        'input_dim': input_dimension, 
-        'output_dim': output_dim, 
-        'seed': seed_val
-    }
+    builders = _model_builders(input_dimension, output_dim, hidden_units_wide, hidden_units_deep, hidden_layers, num_exps)
+    return [(build(seed_val), name) for name, build in builders]
 
-    models = [
-        (create_linear_model(**common_args), "Linear Model"),
-        (create_wide_relu_ann(hidden_units=hidden_units_wide, **common_args), "Wide ReLU ANN"),
-        (create_deep_relu_ann(hidden_units=hidden_units_deep, hidden_layers=hidden_layers, **common_args), "Deep ReLU ANN"),
-        (LookupTableModel(partition_num=1, default_val=-1., **common_args), "One Parameter")
-    ]
+class ModelZoo:
+    """Lazy factory for the models of initialize_all_models at one input dimension.
 
-    for partition_num in [1,2,4,8,10]:
-        models.append((SplineANN(partition_num=partition_num, **common_args), 
-                       f"Spline ANN (z={partition_num})"))
-        models.append((LookupTableModel(partition_num=partition_num, default_val=-1., **common_args),
-                       f"Lookup Table (z={partition_num})"))
-        models.append((ABELSpline(partition_num=partition_num, num_exps=num_exps, **common_args), 
-                       f"ABEL-Spline (z={partition_num})"))
+    A model is only constructed when a run asks for it by name, and each (name, seed) is constructed once
+    whenever possible: its initial weights are kept, and models given back with release are handed out again
+    as replicas reset to the initial weights of the requested seed. Through a CompiledModelCache, acquire
+    does the same with pooled models whose graphs are already compiled.
 
-    return models
+    Attributes:
+        input_dimension (int): The input dimension of every model in the zoo.
+        hyperparameters (dict): The keyword arguments of initialize_all_models the zoo was created with.
+        names (list): The model names, in the order of initialize_all_models.
+    """
+
+    def __init__(self, input_dimension: int, **hyperparameters):
+        self.input_dimension = input_dimension
+        self.hyperparameters = hyperparameters
+        self._builders = dict(_model_builders(input_dimension, **hyperparameters))
+        self.names = list(self._builders)
+        self._initial_weights = {}
+        self._unused = {}
+        self._released = {}
+        self._signatures = {}
+        self._lock = threading.Lock()
+
+    def create(self, name: str, seed_val: int):
+        """Construct and build a new model, remembering its initial weights the first time (name, seed_val) is built."""
+        model = self._builders[name](seed_val)
+        if not model.built:
+            model(tf.zeros((1, self.input_dimension)))
+        with self._lock:
+            known = (name, seed_val) in self._initial_weights
+        if not known:
+            weights = model.get_weights()
+            with self._lock:
+                self._initial_weights.setdefault((name, seed_val), weights)
+                self._signatures.setdefault(name, CompiledModelCache.signature(model))
+        return model
+
+    def initial_weights(self, name: str, seed_val: int) -> list:
+        """Return the initial weight arrays of a model, constructing it only the first time."""
+        if (name, seed_val) not in self._initial_weights:
+            model = self.create(name, seed_val)
+            with self._lock:
+                self._unused.setdefault((name, seed_val), []).append(model)
+        return self._initial_weights[(name, seed_val)]
+
+    def _take_or_create(self, name: str, seed_val: int):
+        # Hand out a model constructed for initial_weights, then a released replica reset to the initial weights,
+        # and only construct another one when neither is free.
+        with self._lock:
+            unused = self._unused.get((name, seed_val), [])
+            if unused:
+                return unused.pop()
+            released = self._released.get(name, [])
+            replica = released.pop() if released and (name, seed_val) in self._initial_weights else None
+        if replica is None:
+            return self.create(name, seed_val)
+        replica.set_weights(self._initial_weights[(name, seed_val)])
+        return replica
+
+    def models(self, seed_val: int, names: list = None) -> list:
+        """Return (model, name) tuples of models with fresh initial weights, like initialize_all_models, for the
+        requested names only. Models given back with release are reused before new ones are constructed."""
+        return [(self._take_or_create(name, seed_val), name) for name in (names if names is not None else self.names)]
+
+    def release(self, model, name: str):
+        """Give back a model handed out by models once it is no longer used, so later calls can reuse it."""
+        with self._lock:
+            self._released.setdefault(name, []).append(model)
+
+    def acquire(self, name: str, seed_val: int, graph_cache, timings: dict = None):
+        """Return a compiled model with the initial weights of (name, seed_val) from a CompiledModelCache.
+        timings is passed on to CompiledModelCache.acquire_weights."""
+        weights = self.initial_weights(name, seed_val)
+        return graph_cache.acquire_weights(self._signatures[name], weights, lambda: self._take_or_create(name, seed_val),
+                                           timings)
 
 '''
 def initialize_all_models(input_dimension: int, 
@@ -101,7 +202,129 @@ def compile_models(models, optimizer='adam', loss='mean_absolute_error'):
     """Compile TensorFlow/Keras models."""
     for model, name in models:
         model.compile(optimizer=optimizer, loss=loss)
-        
+
+def _without_layer_names(config, in_initializer=False):
+    # Keras numbers auto-generated layer names per instance, and initializer seeds only change the initial
+    # weights, neither says anything about the traced graph.
+    if isinstance(config, dict):
+        return {key: _without_layer_names(value, in_initializer or key.endswith('initializer'))
+                for key, value in config.items() if key != 'name' and not (in_initializer and key == 'seed')}
+    if isinstance(config, list):
+        return [_without_layer_names(value, in_initializer) for value in config]
+    return config
+
+class CompiledModelCache:
+    """Pool of compiled models keyed by (model class, hyperparameters, input signature), so that folds and
+    datasets of the same input dimension reuse the train, test and predict functions Keras already traced.
+
+    acquire hands out a pooled model of the same signature, loaded with the requested model's weights and a
+    freshly reset optimizer, or compiles the requested model itself when none is free. Models are handed out
+    exclusively, so concurrent folds never share one, and go back into the pool with release.
+
+    Attributes:
+        optimizer: The optimizer identifier models are compiled with. Defaults to 'adam'.
+        loss: The loss models are compiled with. Defaults to 'mean_absolute_error'.
+    """
+
+    def __init__(self, optimizer='adam', loss='mean_absolute_error'):
+        self.optimizer = optimizer
+        self.loss = loss
+        self._free = {}
+        self._signatures = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def signature(model) -> tuple:
+        config = json.dumps(_without_layer_names(model.get_config()), sort_keys=True, default=str)
+        return (type(model).__name__, config, getattr(model, 'input_dim', None), 'float32')
+
+    def acquire(self, model):
+        """Return a compiled model computing the same function as `model` with `model`'s current weights."""
+        if not model.built:
+            model(tf.zeros((1, model.input_dim)))
+        return self.acquire_weights(self.signature(model), model.get_weights(), lambda: model)
+
+    def acquire_weights(self, signature: tuple, weights: list, build_model, timings: dict = None):
+        """Like acquire, given a signature and weights instead of a model. build_model is only called, and
+        must return a built model with these weights, when no pooled model of the signature is free.
+        The seconds spent compiling such a new model are stored under 'compile' in timings, if given."""
+        with self._lock:
+            free = self._free.get(signature, [])
+            cached = free.pop() if free else None
+        if timings is not None:
+            timings['compile'] = 0.
+        if cached is None:
+            model = build_model()
+            started = time.perf_counter()
+            model.compile(optimizer=self.optimizer, loss=self.loss)
+            if timings is not None:
+                timings['compile'] = time.perf_counter() - started
+            with self._lock:
+                self._signatures[id(model)] = signature
+            return model
+        cached.set_weights(weights)
+        # Zeroing the iteration count and slot variables is the state of a freshly compiled optimizer.
+        for variable in cached.optimizer.variables:
+            variable.assign(tf.zeros_like(variable))
+        return cached
+
+    def release(self, model):
+        """Return a model handed out by acquire to the pool."""
+        with self._lock:
+            self._free.setdefault(self._signatures[id(model)], []).append(model)
+
+    @contextlib.contextmanager
+    def checkout(self, model):
+        """Context manager form of acquire and release."""
+        compiled = self.acquire(model)
+        try:
+            yield compiled
+        finally:
+            self.release(compiled)
+
+def train_progressively(model, X_train, y_train,
+                        partition_nums: list = [1,2,4,8,10],
+                        epochs=20,
+                        model_label: str = "ABEL-Spline",
+                        optimizer='adam',
+                        loss='mean_absolute_error',
+                        **fit_kwargs) -> tuple:
+    """Train a SplineANN or ABELSpline coarse-to-fine, warm starting each partition number from the last.
+
+    The model is trained at the first (coarsest) partition number, then repartitioned onto each
+    following partition number and trained further. Every stage is kept, so one run yields the
+    whole family of z-models instead of training each one independently from scratch.
+
+    Args:
+        model: A SplineANN or ABELSpline, built with partition_nums[0] partitions.
+        X_train: Training inputs.
+        y_train: Training targets.
+        partition_nums: Increasing partition numbers to train at. Defaults to those of initialize_all_models.
+        epochs: Epochs per stage, either one number for all stages or a list with one entry per stage.
+        model_label: Name prefix of the returned models. Defaults to "ABEL-Spline".
+        optimizer: The optimizer identifier, a fresh optimizer is created for every stage. Defaults to 'adam'.
+        loss: The loss identifier. Defaults to 'mean_absolute_error'.
+        **fit_kwargs: Passed on to every model.fit call (e.g. validation_data, batch_size, callbacks).
+
+    Returns:
+        A list of (model, name) tuples, one per partition number, and the list of their fit histories.
+    """
+    if model.partition_num != partition_nums[0]:
+        raise ValueError(f"Model has {model.partition_num} partitions, expected {partition_nums[0]}.")
+    if isinstance(epochs, int):
+        epochs = [epochs] * len(partition_nums)
+
+    models, histories = [], []
+    for stage, (partition_num, stage_epochs) in enumerate(zip(partition_nums, epochs)):
+        if stage > 0:
+            model = model.repartition(partition_num)
+        model.compile(optimizer=optimizer, loss=loss)
+        history = model.fit(X_train, y_train, epochs=stage_epochs, verbose=0, **fit_kwargs)
+        models.append((model, f"{model_label} (z={partition_num})"))
+        histories.append(history)
+
+    return models, histories
+
 def preprocess_target_values(train_data, test_data):
     """Preprocess the data by zero-centering, scaling to unit variance, and applying a sigmoid."""
     bias = np.mean(train_data, axis=0)
@@ -125,6 +348,83 @@ def preprocess_data(train_data, test_data):
     
     return train_data, test_data
 
+class StreamingStandardizer:
+    """Out-of-core equivalent of preprocess_data (squash=True) and preprocess_target_values (squash=False).
+
+    The mean and (population) standard deviation are accumulated in float64 over chunks with the parallel
+    form of Welford's update, so the training data never has to be in memory at once. The transform can
+    then be applied per batch, or chunk by chunk in place, e.g. on np.memmap arrays.
+
+    Attributes:
+        squash (bool): Whether the standardized values are passed through a sigmoid.
+        count (int): The number of rows accumulated.
+        mean (np.ndarray): The running mean per column.
+        m2 (np.ndarray): The running sum of squared deviations per column.
+    """
+
+    def __init__(self, squash: bool = True):
+        self.squash = squash
+        self.count = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def partial_fit(self, chunk: np.ndarray):
+        """Fold a chunk of rows into the statistics."""
+        chunk = np.asarray(chunk, dtype=np.float64)
+        chunk_count = len(chunk)
+        if chunk_count == 0:
+            return self
+        chunk_mean = np.mean(chunk, axis=0)
+        delta = chunk_mean - self.mean
+        total = self.count + chunk_count
+        self.m2 = self.m2 + np.sum((chunk - chunk_mean)**2, axis=0) + delta**2 * self.count * chunk_count / total
+        self.mean = self.mean + delta * chunk_count / total
+        self.count = total
+        return self
+
+    def fit(self, data: np.ndarray, chunk_size: int = 100000):
+        """Accumulate the statistics of a (possibly memory-mapped) array in one chunked pass."""
+        for start in range(0, len(data), chunk_size):
+            self.partial_fit(data[start:start + chunk_size])
+        return self
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.m2 / self.count)
+
+    def transform(self, chunk: np.ndarray) -> np.ndarray:
+        """Return the standardized (and squashed) copy of a chunk of rows."""
+        transformed = (chunk - self.mean) / self.std
+        if self.squash:
+            transformed = 1 / (1 + np.exp(-transformed))
+        return transformed
+
+    def transform_in_place(self, data: np.ndarray, chunk_size: int = 100000) -> np.ndarray:
+        """Overwrite a floating point (possibly memory-mapped) array with its transform, one chunk at a time."""
+        for start in range(0, len(data), chunk_size):
+            data[start:start + chunk_size] = self.transform(data[start:start + chunk_size])
+        if isinstance(data, np.memmap):
+            data.flush()
+        return data
+
+    def batches(self, data: np.ndarray, batch_size: int = 10000):
+        """Lazily yield the transform of consecutive batches of rows."""
+        for start in range(0, len(data), batch_size):
+            yield self.transform(data[start:start + batch_size])
+
+def standardized_dataset(X: np.ndarray, y: np.ndarray, feature_standardizer: StreamingStandardizer,
+                         target_standardizer: StreamingStandardizer, batch_size: int = 32) -> tf.data.Dataset:
+    """Return a tf.data.Dataset of standardized (inputs, targets) batches for fit, reading X and y (e.g.
+    memory-mapped arrays) and transforming one batch at a time."""
+
+    def generate():
+        for start in range(0, len(X), batch_size):
+            yield (feature_standardizer.transform(X[start:start + batch_size]).astype(np.float32),
+                   target_standardizer.transform(y[start:start + batch_size]).astype(np.float32))
+
+    return tf.data.Dataset.from_generator(generate, output_signature=(
+        tf.TensorSpec((None,) + tuple(X.shape[1:]), tf.float32), tf.TensorSpec((None,) + tuple(y.shape[1:]), tf.float32)))
+
 
 def create_linear_model(input_dim: int, output_dim: int = 1, seed: int = 42) -> Sequential:
     """Create a linear model with rescaling and a dense layer.
@@ -192,6 +492,7 @@ class LookupTableModel(tf.keras.Model):
         super(LookupTableModel, self).__init__()
         self.input_dim = input_dim
         self.partition_num = partition_num
+        self.output_dim = output_dim
         initializer = tf.keras.initializers.RandomUniform(seed=seed)
         self.embedding = tf.keras.layers.Embedding(partition_num**input_dim + 1, output_dim,
                                                    embeddings_initializer=initializer)
@@ -205,7 +506,11 @@ class LookupTableModel(tf.keras.Model):
         # Changed to integer type
         self.partition_num_powers = tf.cast(tf.pow(partition_num, tf.range(input_dim)), dtype=tf.int32)
 
-    def call(self, inputs: tf.Tensor) -> tf.Tensor:
+    def get_config(self) -> dict:
+        return {'input_dim': self.input_dim, 'partition_num': self.partition_num,
+                'output_dim': self.output_dim, 'default_val': float(self.default_val)}
+
+    def cell_indices(self, inputs: tf.Tensor) -> tf.Tensor:
         # ReLU operation to drop negative inputs 
         inputs = tf.maximum(0., inputs)
 
@@ -217,10 +522,172 @@ class LookupTableModel(tf.keras.Model):
 
         # Flatten each vector to get a single index for each sample.
         indices = tf.reduce_sum(bounded_inputs * self.partition_num_powers, axis=1)
+        return indices
 
-        
-        outputs = self.embedding(indices)
+    def call(self, inputs: tf.Tensor) -> tf.Tensor:
+        outputs = self.embedding(self.cell_indices(inputs))
         return outputs
+
+    def fit_direct(self, inputs: np.ndarray, targets: np.ndarray, statistic: str = 'median', batch_size: int = 100000):
+        """Fit the table in one pass over the data instead of by gradient descent.
+
+        Every visited cell is set to the median (the mean absolute error optimum) or the mean (the mean
+        squared error optimum) of the targets falling in it, unvisited cells are set to the default value.
+
+        Args:
+            inputs: The input array of shape [n, input_dim].
+            targets: The target array of shape [n] or [n, output_dim].
+            statistic: Either 'median' or 'mean'. Defaults to 'median'.
+            batch_size: The number of inputs whose cell indices are computed at once. Defaults to 100000.
+
+        Returns:
+            The model itself, with its table replaced.
+        """
+        num_cells = self.partition_num**self.input_dim
+        output_dim = self.embedding.output_dim
+        targets = np.reshape(targets, (len(inputs), output_dim))
+        counts = np.zeros(num_cells)
+        cell_values = np.zeros((num_cells, output_dim))
+        if statistic == 'mean':
+            for start in range(0, len(inputs), batch_size):
+                indices = self.cell_indices(tf.constant(inputs[start:start + batch_size], dtype=tf.float32)).numpy()
+                counts += np.bincount(indices, minlength=num_cells)
+                for j in range(output_dim):
+                    cell_values[:, j] += np.bincount(indices, weights=targets[start:start + batch_size, j], minlength=num_cells)
+            cell_values[counts > 0] /= counts[counts > 0, np.newaxis]
+        elif statistic == 'median':
+            indices = np.concatenate([self.cell_indices(tf.constant(inputs[start:start + batch_size], dtype=tf.float32)).numpy()
+                                      for start in range(0, len(inputs), batch_size)])
+            counts = np.bincount(indices, minlength=num_cells)
+            for j in range(output_dim):
+                # Sort by cell, then by target, and take the middle element(s) of each cell's run.
+                order = np.lexsort((targets[:, j], indices))
+                sorted_indices, sorted_targets = indices[order], targets[order, j]
+                cells, starts, cell_counts = np.unique(sorted_indices, return_index=True, return_counts=True)
+                lower = sorted_targets[starts + (cell_counts - 1) // 2]
+                upper = sorted_targets[starts + cell_counts // 2]
+                cell_values[cells, j] = (lower + upper) / 2.
+        else:
+            raise ValueError(f"Unknown statistic '{statistic}', expected 'median' or 'mean'.")
+
+        table = np.full((num_cells + 1, output_dim), float(self.default_val), dtype=np.float32)
+        table[:num_cells][counts > 0] = cell_values[counts > 0]
+        self.embedding.set_weights([table])
+        return self
+
+class MemmapLookupTableModel(tf.keras.Model):
+    """LookupTableModel whose table lives in a memory-mapped file instead of an in-memory Embedding.
+
+    Only the rows a batch touches are paged in, both for inference and for training, so tables with more
+    rows than fit in RAM keep a bounded resident memory. Training updates only the unique rows of each
+    batch: with plain gradient descent for SGD without momentum, or with a lazy Adam whose moments are kept
+    in memory-mapped files next to the table, for Adam. Unlike Keras' dense Adam, the moments of rows a
+    batch does not touch are left as they are. Compiling with any other optimizer raises a ValueError.
+    Reopening an existing table also reopens its Adam moments, so training resumes with the optimizer state.
+
+    Attributes:
+        input_dim (int): The number of input dimensions.
+        partition_num (int): The number of partitions per input dimension.
+        output_dim (int): The number of outputs.
+        default_val (float): The value of the last (default) table row.
+        path (str): The file holding the table, of shape [partition_num**input_dim + 1, output_dim] float32.
+        table (np.memmap): The memory-mapped table.
+    """
+
+    cell_indices = LookupTableModel.cell_indices
+
+    def __init__(self, input_dim: int, partition_num: int, output_dim: int = 1,
+                 default_val: float = 0.0, seed: int = 55, path: str = None, chunk_rows: int = 1000000):
+        super(MemmapLookupTableModel, self).__init__()
+        self.input_dim = input_dim
+        self.partition_num = partition_num
+        self.output_dim = output_dim
+        self.default_val = default_val
+        self.path = path if path is not None else os.path.join(tempfile.mkdtemp(), 'lookup_table.dat')
+        self.partition_num_powers = tf.cast(tf.pow(partition_num, tf.range(input_dim)), dtype=tf.int32)
+        num_rows = partition_num**input_dim + 1
+
+        self._reopened = os.path.exists(self.path) and os.path.getsize(self.path) == num_rows * output_dim * 4
+        if self._reopened:
+            self.table = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(num_rows, output_dim))
+        else:
+            # Same initial distribution as the Embedding's RandomUniform, written a chunk at a time.
+            self.table = np.memmap(self.path, dtype=np.float32, mode='w+', shape=(num_rows, output_dim))
+            rng = np.random.default_rng(seed)
+            for start in range(0, num_rows - 1, chunk_rows):
+                stop = min(start + chunk_rows, num_rows - 1)
+                self.table[start:stop] = rng.uniform(-0.05, 0.05, (stop - start, output_dim))
+            self.table[-1] = default_val
+            self.table.flush()
+        self._moments = None
+
+    def get_config(self) -> dict:
+        return {'input_dim': self.input_dim, 'partition_num': self.partition_num,
+                'output_dim': self.output_dim, 'default_val': self.default_val, 'path': self.path}
+
+    def _read_rows(self, rows: tf.Tensor) -> tf.Tensor:
+        values = tf.numpy_function(lambda rows: self.table[rows], [rows], tf.float32, stateful=True)
+        values.set_shape([None, self.output_dim])
+        return values
+
+    def call(self, inputs: tf.Tensor) -> tf.Tensor:
+        rows, positions = tf.unique(self.cell_indices(inputs))
+        return tf.gather(self._read_rows(rows), positions)
+
+    def compile(self, optimizer='rmsprop', *args, **kwargs):
+        super(MemmapLookupTableModel, self).compile(optimizer, *args, **kwargs)
+        # Only these update rules are implemented on the memory-mapped rows, anything else would silently differ.
+        plain_sgd = isinstance(self.optimizer, tf.keras.optimizers.SGD) and \
+            float(self.optimizer.momentum) == 0. and not self.optimizer.nesterov
+        plain_adam = isinstance(self.optimizer, tf.keras.optimizers.Adam) and not self.optimizer.amsgrad
+        modified = any(getattr(self.optimizer, option, None) for option in
+                       ['weight_decay', 'clipnorm', 'clipvalue', 'global_clipnorm', 'use_ema'])
+        if not (plain_sgd or plain_adam) or modified:
+            raise ValueError(f"MemmapLookupTableModel only supports SGD without momentum and Adam without amsgrad, "
+                             f"weight decay, clipping or EMA, got {type(self.optimizer).__name__}.")
+
+    def _open_moment(self, path: str) -> np.memmap:
+        # Moments left by a new table's predecessor at the same path belong to other values, so they are zeroed.
+        if self._reopened and os.path.exists(path) and os.path.getsize(path) == self.table.nbytes:
+            return np.memmap(path, dtype=np.float32, mode='r+', shape=self.table.shape)
+        return np.memmap(path, dtype=np.float32, mode='w+', shape=self.table.shape)
+
+    def _apply_gradients(self, rows: np.ndarray, gradients: np.ndarray, learning_rate: np.ndarray, step: np.ndarray) -> np.int64:
+        if isinstance(self.optimizer, tf.keras.optimizers.Adam):
+            if self._moments is None:
+                self._moments = [self._open_moment(self.path + suffix) for suffix in ['.m', '.v']]
+            m, v = self._moments
+            beta_1, beta_2 = float(self.optimizer.beta_1), float(self.optimizer.beta_2)
+            m_rows = m[rows] + (gradients - m[rows]) * (1 - beta_1)
+            v_rows = v[rows] + (gradients**2 - v[rows]) * (1 - beta_2)
+            m[rows], v[rows] = m_rows, v_rows
+            alpha = learning_rate * np.sqrt(1 - beta_2**step) / (1 - beta_1**step)
+            self.table[rows] -= alpha * m_rows / (np.sqrt(v_rows) + self.optimizer.epsilon)
+        else:
+            self.table[rows] -= learning_rate * gradients
+        return np.int64(len(rows))
+
+    def train_step(self, data):
+        inputs, targets, sample_weight = tf.keras.utils.unpack_x_y_sample_weight(data)
+        rows, positions = tf.unique(self.cell_indices(inputs))
+        values = self._read_rows(rows)
+        with tf.GradientTape() as tape:
+            tape.watch(values)
+            predictions = tf.gather(values, positions)
+            loss = self.compiled_loss(targets, predictions, sample_weight)
+        gradients = tape.gradient(loss, values)
+        step = self.optimizer.iterations.assign_add(1)
+        tf.numpy_function(self._apply_gradients,
+                          [rows, gradients, tf.cast(self.optimizer.learning_rate, tf.float32), tf.cast(step, tf.float32)],
+                          tf.int64, stateful=True)
+        self.compiled_metrics.update_state(targets, predictions, sample_weight)
+        return {metric.name: metric.result() for metric in self.metrics}
+
+    def flush(self):
+        """Write the dirty pages of the table (and the Adam moments) back to disk."""
+        self.table.flush()
+        for moment in self._moments or []:
+            moment.flush()
 '''
 class LookupTableModel(tf.keras.Model):
     """A lookup table model.
@@ -317,10 +784,14 @@ class ABELSpline(keras.Model):
         if self.num_exps > 0:
             spline_additive_output = self.indirect_sam(inputs)
             output_anti_symmetric_exponential = self.anti_symmetric_exponential_layer(spline_additive_output)
-            output_accumulator = tf.keras.layers.Add()([output_accumulator, output_anti_symmetric_exponential])
+            output_accumulator = output_accumulator + output_anti_symmetric_exponential
         
         return output_accumulator
 
+    def get_config(self) -> dict:
+        return {'input_dim': self.input_dim, 'partition_num': self.partition_num,
+                'num_exps': self.num_exps, 'output_dim': self.output_dim}
+
     def repartition(self, new_partition_num):
         """
         Create a new ABELSpline model with a different number of partitions.
@@ -356,10 +827,15 @@ class AntiSymmetricExponential(tf.keras.layers.Layer):
         exponentials = tf.math.exp(add_bias)
         summed = tf.reduce_sum(exponentials,axis=-1 ,keepdims=False)
         list_of_exponentials = tf.split(summed,num_or_size_splits=2,axis=-1)
-        difference = tf.keras.layers.subtract(list_of_exponentials)
+        difference = list_of_exponentials[0] - list_of_exponentials[1]
         output = self.reshape_output(difference)
         
         return output
+
+    def get_config(self) -> dict:
+        config = super(AntiSymmetricExponential, self).get_config()
+        config.update({'num_exps': self.num_exps, 'output_dim': self.output_dim})
+        return config
     
 def cubic_spline(x: tf.Tensor) -> tf.Tensor:
     """
@@ -388,6 +864,7 @@ class SplineANN(keras.Model):
         super(SplineANN, self).__init__()
         self.input_dim = input_dim 
         self.output_dim = output_dim
+        self.partition_num = partition_num
         self.density = 4*partition_num + 3
         self.input_dimension_shift = tf.repeat(tf.range(0., self.input_dim, dtype=tf.float32) * self.density, 4)
         self.reshape_input = Reshape((self.input_dim,1), name="Reshape_Input")
@@ -401,17 +878,77 @@ class SplineANN(keras.Model):
         self.control_points = self._create_control_points(seed)
 
     def call(self, input_tensor: tf.Tensor, training: bool = False) -> tf.Tensor:
-        reshaped_input = self.reshape_input(input_tensor)
-        spline_values = self.reshape_splines(self.cubic_spline(self.scale_floormod(reshaped_input)))
+        # A precomputed (spline values, control point indices) pair from cached_spline_basis skips the basis.
+        if isinstance(input_tensor, (tuple, list)):
+            spline_values, control_point_indices = input_tensor
+        else:
+            spline_values, control_point_indices = self.spline_basis(input_tensor)
         #transposed_splines = tf.transpose(self.repeat_splines(spline_values), perm=[0, 2, 1])
         transposed_splines = tf.transpose(self.repeat_splines(spline_values), perm=[0, 2, 1])
+        control_points_values = self.control_points(control_point_indices)
+        #print(control_points_values.shape)
+        #return tf.math.reduce_sum(Multiply()([transposed_splines,control_points_values]),1, keepdims=False)
+        return tf.math.reduce_sum(transposed_splines * control_points_values, -2, keepdims=False)
+
+    def spline_basis(self, input_tensor: tf.Tensor) -> tuple:
+        """Compute the non-zero cubic spline values of each input and the control points they weigh.
+
+        :param input_tensor: Input tensor of shape [batch, input_dim]
+        :return: Spline values (float32) and control point indices (int32), both of shape [batch, 4*input_dim]
+        """
+        reshaped_input = self.reshape_input(input_tensor)
+        spline_values = self.reshape_splines(self.cubic_spline(self.scale_floormod(reshaped_input)))
         floor_shift_values = self.reshape_ints(self.floor_shift(reshaped_input)) 
         floor_div_values = tf.math.floormod(floor_shift_values, self.density)
         adjusted_input_dim_values = tf.nn.bias_add(floor_div_values, self.input_dimension_shift)
-        control_points_values = self.control_points(adjusted_input_dim_values)
-        #print(control_points_values.shape)
-        #return tf.math.reduce_sum(Multiply()([transposed_splines,control_points_values]),1, keepdims=False)
-        return tf.math.reduce_sum(Multiply()([transposed_splines,control_points_values]),-2, keepdims=False)
+        return spline_values, tf.cast(adjusted_input_dim_values, dtype=tf.int32)
+
+    def design_matrix(self, inputs: np.ndarray, batch_size: int = 10000) -> scipy.sparse.csr_matrix:
+        """Assemble the sparse design matrix of the inputs, with one column per control point row.
+
+        Row i holds the 4*input_dim non-zero spline values of inputs[i], so that
+        model(inputs)[:, j] equals design_matrix(inputs) @ control_points[:, j].
+
+        :param inputs: Input array of shape [n, input_dim]
+        :param batch_size: Number of inputs passed through spline_basis at once
+        :return: Sparse matrix of shape [n, input_dim * density]
+        """
+        blocks = []
+        for start in range(0, len(inputs), batch_size):
+            spline_values, indices = self.spline_basis(tf.constant(inputs[start:start + batch_size], dtype=tf.float32))
+            num_rows, row_length = indices.shape
+            indptr = np.arange(0, num_rows * row_length + 1, row_length)
+            blocks.append(scipy.sparse.csr_matrix((spline_values.numpy().ravel(), indices.numpy().ravel(), indptr),
+                                                  shape=(num_rows, self.input_dim * self.density)))
+        return scipy.sparse.vstack(blocks, format='csr')
+
+    def fit_least_squares(self, inputs: np.ndarray, targets: np.ndarray, l2: float = 1e-6, batch_size: int = 10000):
+        """
+        Fit the control points in closed form by (ridge regularized) least squares.
+
+        The output is linear in the control points, so the mean squared error is minimized exactly by
+        solving the sparse normal equations, instead of running many epochs of gradient descent. A small
+        l2 keeps the system non-singular, since unvisited control points and the constant shared between
+        input dimensions are otherwise undetermined. With l2 = 0 the minimum norm solution is computed.
+
+        :param inputs: Input array of shape [n, input_dim]
+        :param targets: Target array of shape [n] or [n, output_dim]
+        :param l2: Ridge penalty on the control points
+        :param batch_size: Number of inputs passed through spline_basis at once
+        :return: The model itself, with its control points replaced
+        """
+        design = self.design_matrix(inputs, batch_size).astype(np.float64)
+        targets = np.reshape(targets, (len(inputs), self.output_dim)).astype(np.float64)
+        if l2 > 0:
+            normal_matrix = design.T @ design + l2 * scipy.sparse.identity(design.shape[1])
+            control_points = scipy.sparse.linalg.spsolve(normal_matrix.tocsc(), design.T @ targets)
+        else:
+            control_points = np.stack([scipy.sparse.linalg.lsqr(design, targets[:, j])[0]
+                                       for j in range(self.output_dim)], axis=1)
+        if not self.built:
+            self.build(input_shape=(None, self.input_dim))
+        self.control_points.set_weights([np.reshape(control_points, (-1, self.output_dim)).astype(np.float32)])
+        return self
 
     def _create_control_points(self, seed : int) -> Embedding:
         return Embedding(self.input_dim * self.density, 
@@ -441,6 +978,9 @@ class SplineANN(keras.Model):
             name=name
         )
 
+    def get_config(self) -> dict:
+        return {'input_dim': self.input_dim, 'output_dim': self.output_dim, 'partition_num': self.partition_num}
+
     def construct(self) -> None:
         self(tf.keras.layers.Input(shape=(self.input_dim,)))
         self.call(keras.Input(shape=(self.input_dim,)))
@@ -503,3 +1043,175 @@ class SplineANN(keras.Model):
         del knots, density
         new_model.control_points.set_weights([new_weights])
         return new_model
+
+def cached_spline_basis(inputs: np.ndarray, partition_num: int, cache_dir: str = 'spline_basis_cache',
+                        batch_size: int = 10000, mmap_mode: str = 'r') -> tuple:
+    """Return the spline basis of an input array, computed once and cached on disk.
+
+    The basis only depends on the inputs and the partition number, so every SplineANN and ABELSpline with
+    that partition number can train on it for any number of epochs: passing the returned pair as the
+    inputs of fit, evaluate or predict reduces each step to a gather, multiply and reduce.
+
+    Args:
+        inputs: The input array of shape [n, input_dim].
+        partition_num: The partition number of the models that will consume the basis.
+        cache_dir: The directory of the cache, keyed by a hash of the inputs and the partition number.
+            Defaults to 'spline_basis_cache'.
+        batch_size: The number of inputs whose basis is computed at once. Defaults to 10000.
+        mmap_mode: How the cached arrays are loaded, see np.load. Defaults to 'r' (memory-mapped).
+
+    Returns:
+        The spline values (float32) and control point indices (int32), both of shape [n, 4*input_dim].
+    """
+    inputs = np.ascontiguousarray(inputs, dtype=np.float32)
+    key = hashlib.sha1(inputs.tobytes() + str(inputs.shape).encode()).hexdigest()
+    paths = [os.path.join(cache_dir, f"{key}-z{partition_num}-{name}.npy") for name in ['values', 'indices']]
+
+    if not all(os.path.exists(path) for path in paths):
+        os.makedirs(cache_dir, exist_ok=True)
+        spline_ann = SplineANN(input_dim=inputs.shape[1], output_dim=1, partition_num=partition_num)
+        bases = [spline_ann.spline_basis(tf.constant(inputs[start:start + batch_size]))
+                 for start in range(0, len(inputs), batch_size)]
+        arrays = [np.concatenate([basis[i].numpy() for basis in bases]) for i in range(2)]
+        # Write under a temporary name first so concurrent readers never load a partial file.
+        for path, array in zip(paths, arrays):
+            temporary_path = path[:-len('.npy')] + f'.{os.getpid()}.{threading.get_ident()}.tmp.npy'
+            np.save(temporary_path, array)
+            os.replace(temporary_path, path)
+
+    return tuple(np.load(path, mmap_mode=mmap_mode) for path in paths)
+
+def _quantize_blocks(blocks: np.ndarray, dtype: str) -> tuple:
+    """Quantize float blocks [num_blocks, rows, output_dim] with one scale per block and output dimension."""
+    if dtype == 'float16':
+        return blocks.astype(np.float16), np.ones((blocks.shape[0], blocks.shape[2]), dtype=np.float32)
+    if dtype != 'int8':
+        raise ValueError(f"Unknown dtype '{dtype}', expected 'int8' or 'float16'.")
+    max_abs = np.max(np.abs(blocks), axis=1)
+    scales = np.where(max_abs > 0, max_abs / 127., 1.).astype(np.float32)
+    quantized = np.clip(np.round(blocks / scales[:, np.newaxis, :]), -127, 127).astype(np.int8)
+    return quantized, scales
+
+class QuantizedSplineANN(SplineANN):
+    """Inference-only SplineANN storing its control points as int8 (or float16) with a float32 scale per
+    input dimension and output. Only the gathered control points are dequantized, inside call."""
+
+    def __init__(self, spline_ann: SplineANN, dtype: str = 'int8'):
+        super(QuantizedSplineANN, self).__init__(spline_ann.input_dim, spline_ann.output_dim, spline_ann.partition_num)
+        weights = spline_ann.control_points.get_weights()[0]
+        quantized, scales = _quantize_blocks(weights.reshape(self.input_dim, self.density, self.output_dim), dtype)
+        self.quantized_control_points = tf.constant(quantized.reshape(-1, self.output_dim))
+        self.control_point_scales = tf.constant(scales)
+
+    def call(self, input_tensor: tf.Tensor, training: bool = False) -> tf.Tensor:
+        spline_values, control_point_indices = self.spline_basis(input_tensor)
+        # Each control point index lies in the block of its input dimension, which selects the scale.
+        control_points_values = (tf.cast(tf.gather(self.quantized_control_points, control_point_indices), tf.float32)
+                                 * tf.gather(self.control_point_scales, control_point_indices // self.density))
+        return tf.math.reduce_sum(spline_values[..., tf.newaxis] * control_points_values, -2, keepdims=False)
+
+class QuantizedLookupTableModel(tf.keras.Model):
+    """Inference-only LookupTableModel storing its table as int8 (or float16) with one float32 scale per output."""
+
+    cell_indices = LookupTableModel.cell_indices
+
+    def __init__(self, lookup_table: LookupTableModel, dtype: str = 'int8'):
+        super(QuantizedLookupTableModel, self).__init__()
+        self.input_dim = lookup_table.input_dim
+        self.partition_num = lookup_table.partition_num
+        self.partition_num_powers = lookup_table.partition_num_powers
+        quantized, scales = _quantize_blocks(lookup_table.embedding.get_weights()[0][np.newaxis], dtype)
+        self.quantized_table = tf.constant(quantized[0])
+        self.table_scales = tf.constant(scales[0])
+
+    def call(self, inputs: tf.Tensor) -> tf.Tensor:
+        return tf.cast(tf.gather(self.quantized_table, self.cell_indices(inputs)), tf.float32) * self.table_scales
+
+def quantize_model(model, dtype: str = 'int8'):
+    """Return an inference-only copy of a SplineANN, LookupTableModel or ABELSpline with quantized control points.
+
+    Args:
+        model: The trained float model.
+        dtype: Either 'int8' (4x smaller tables) or 'float16' (2x smaller tables). Defaults to 'int8'.
+
+    Returns:
+        The quantized model.
+    """
+    if isinstance(model, SplineANN):
+        return QuantizedSplineANN(model, dtype)
+    if isinstance(model, LookupTableModel):
+        return QuantizedLookupTableModel(model, dtype)
+    if isinstance(model, ABELSpline):
+        quantized = ABELSpline(**model.get_config())
+        quantized.direct_sam = QuantizedSplineANN(model.direct_sam, dtype)
+        if model.num_exps > 0:
+            quantized.indirect_sam = QuantizedSplineANN(model.indirect_sam, dtype)
+        return quantized
+    raise ValueError(f"Cannot quantize {type(model).__name__}.")
+
+def table_bytes(model) -> int:
+    """Return the number of bytes taken by the control point tables (and scales) of a float or quantized model."""
+    tensors = [model.quantized_control_points, model.control_point_scales] if isinstance(model, QuantizedSplineANN) else \
+              [model.quantized_table, model.table_scales] if isinstance(model, QuantizedLookupTableModel) else \
+              [model.control_points.embeddings] if isinstance(model, SplineANN) else \
+              [model.embedding.embeddings] if isinstance(model, LookupTableModel) else []
+    if isinstance(model, ABELSpline):
+        return sum(table_bytes(sam) for sam in [model.direct_sam, getattr(model, 'indirect_sam', None)] if sam is not None)
+    return int(sum(np.prod(t.shape) * t.dtype.size for t in tensors))
+
+def quantization_report(model, quantized_model, X_test: np.ndarray, y_test: np.ndarray) -> dict:
+    """Compare a quantized model against its float model on test data.
+
+    Returns:
+        A dict with the test MSE of both models, the change in MSE, the largest absolute prediction
+        difference and the table sizes in bytes.
+    """
+    predictions = model.predict(X_test, verbose=0)
+    quantized_predictions = quantized_model.predict(X_test, verbose=0)
+    test_error = mean_squared_error(y_test, predictions)
+    quantized_test_error = mean_squared_error(y_test, quantized_predictions)
+    return {'test_error': test_error,
+            'quantized_test_error': quantized_test_error,
+            'test_error_delta': quantized_test_error - test_error,
+            'max_prediction_delta': float(np.max(np.abs(predictions - quantized_predictions))),
+            'table_bytes': table_bytes(model),
+            'quantized_table_bytes': table_bytes(quantized_model)}
+
+COMPACT_MODEL_CLASSES = {cls.__name__: cls for cls in [SplineANN, ABELSpline, LookupTableModel, AntiSymmetricExponential, Sequential]}
+
+def save_compact(model, path: str):
+    """Save a model as its class name, its config and its weight arrays in a single .npz file.
+
+    Unlike a SavedModel nothing is traced, so saving only costs writing the arrays.
+
+    Args:
+        model: A SplineANN, ABELSpline, LookupTableModel, AntiSymmetricExponential or Sequential model.
+        path: The file to write, '.npz' is appended if missing.
+    """
+    class_name = type(model).__name__
+    if class_name not in COMPACT_MODEL_CLASSES:
+        raise ValueError(f"Cannot save {class_name}, expected one of {list(COMPACT_MODEL_CLASSES)}.")
+    weights = {f'weight_{i}': weight for i, weight in enumerate(model.get_weights())}
+    np.savez(path, class_name=class_name, config=json.dumps(model.get_config()), **weights)
+
+def load_compact(path: str):
+    """Load a model written by save_compact.
+
+    The model is rebuilt from its config with one eager call and the weight arrays are read from the
+    (lazily loaded) archive one at a time, so no graph is retraced or deserialized.
+
+    Args:
+        path: The .npz file written by save_compact.
+
+    Returns:
+        The model, ready to call, compile or continue training.
+    """
+    with np.load(path) as archive:
+        model_class = COMPACT_MODEL_CLASSES[str(archive['class_name'])]
+        config = json.loads(str(archive['config']))
+        model = model_class.from_config(config)
+        if 'input_dim' in config:
+            model(tf.zeros((1, config['input_dim'])))
+        num_weights = len([key for key in archive.files if key.startswith('weight_')])
+        model.set_weights([archive[f'weight_{i}'] for i in range(num_weights)])
+    return model
@@ -0,0 +1,703 @@
+import json
+import os
+import multiprocessing
+import queue
+import resource
+import socket
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import KFold
+from model_data_definitions import *
+from concurrent.futures import ThreadPoolExecutor
+
+SUMMARY_METRICS = ['r_squared_value', 'test_error', 'loss', 'train_history']
+SUMMARY_FACETS = ['dataset', 'n_instances', 'n_features', 'n_binary_features', 'n_categorical_features',
+                  'n_continuous_features', 'endpoint_type', 'n_classes', 'imbalance', 'task']
+SUMMARY_FILE_PREFIXES = {'r_squared_value': 'r_squared_values', 'test_error': 'test_error_values', 'loss': 'loss_values'}
+
+TELEMETRY_LOG = 'aggregate_results/telemetry.jsonl'
+_telemetry_lock = threading.Lock()
+
+# One lazily filled ModelZoo per input dimension, shared by all folds and datasets
+_model_zoos = {}
+_model_zoos_lock = threading.Lock()
+
+# Compiled evaluation steps per model, so models reused through a CompiledModelCache are traced once.
+_evaluation_steps = weakref.WeakKeyDictionary()
+
+class RunningSummaries:
+    """Streaming mean and standard deviation of the result metrics per (epoch budget, facet value, model).
+
+    Every finished work unit is folded in with Welford's update, so tables never need to re-read the raw
+    results. Each dataset metadata column in SUMMARY_FACETS is a facet, the dataset name itself included,
+    and the statistics are stored as stats[epoch_number][metric][facet][facet_value][model] = [count, mean, M2].
+    Results after different numbers of epochs, e.g. the milestones of one run, are never averaged together.
+
+    Attributes:
+        path: The JSON file the summaries are persisted to, or None.
+        stats: The nested statistics.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.stats = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as file:
+                self.stats = json.load(file)
+
+    def update(self, results: dict, metadata: dict, epoch_number: int):
+        """Fold one work unit's results into the statistics of every facet of its dataset.
+
+        Args:
+            results: The results dict written by train_evaluate_model.
+            metadata: The dataset's metadata row, as a dict including 'dataset'.
+            epoch_number: The number of epochs the model was trained for when the results were taken.
+        """
+        with self._lock:
+            budget_stats = self.stats.setdefault(str(epoch_number), {})
+            for metric in SUMMARY_METRICS:
+                # Like the table notebooks, training error is summarized by the final epoch.
+                value = results[metric][-1] if metric == 'train_history' else results[metric]
+                for facet in SUMMARY_FACETS:
+                    if facet not in metadata:
+                        continue
+                    facet_stats = budget_stats.setdefault(metric, {}).setdefault(facet, {})
+                    count, mean, m2 = facet_stats.setdefault(str(metadata[facet]), {}).get(results['model'], [0, 0., 0.])
+                    count += 1
+                    delta = float(value) - mean
+                    mean += delta / count
+                    m2 += delta * (float(value) - mean)
+                    facet_stats[str(metadata[facet])][results['model']] = [count, mean, m2]
+            if self.path is not None:
+                self._save()
+
+    def _save(self):
+        # Write to a temporary file first so a crash never leaves a truncated summary behind.
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(self.stats, file)
+        os.replace(temporary_path, self.path)
+
+    def epoch_numbers(self) -> list:
+        """Return the summarized epoch budgets in increasing order."""
+        return sorted(int(epoch_number) for epoch_number in self.stats)
+
+    def mean_std(self, metric: str, facet: str, facet_value, model_name: str, epoch_number: int) -> tuple:
+        """Return the mean and (population) standard deviation of a metric for one facet value, model and epoch budget."""
+        count, mean, m2 = self.stats[str(epoch_number)][metric][facet][str(facet_value)][model_name]
+        return mean, np.sqrt(m2 / count)
+
+    def mean_std_over_all_metrics(self, epoch_number: int) -> dict:
+        """Return the means and standard deviations per dataset after epoch_number epochs in the layout used by
+        the table notebooks, mean_std_over_all_metrics[metric][dataset_name][model_name]['mean' or 'std']."""
+        budget_stats = self.stats.get(str(epoch_number), {})
+        return {metric: {dataset_name: {model_name: dict(zip(['mean', 'std'], self.mean_std(metric, 'dataset', dataset_name,
+                                                                                           model_name, epoch_number)))
+                                        for model_name in models}
+                         for dataset_name, models in budget_stats[metric]['dataset'].items()}
+                for metric in budget_stats}
+
+    def facet_table(self, metric: str, facet: str, model_names: list, epoch_number: int) -> str:
+        """Render one metric after epoch_number epochs grouped by a facet as a LaTeX tabular, one row per model
+        and one column per facet value."""
+        facet_stats = self.stats.get(str(epoch_number), {}).get(metric, {}).get(facet, {})
+        facet_values = sorted(facet_stats, key=_facet_sort_key)
+        lines = ["\\begin{tabular}{|l|" + "c|" * len(facet_values) + "}", "\\hline",
+                 "Model & " + " & ".join("\\texttt{" + value.replace("_", "\\_") + "}" for value in facet_values) + " \\\\",
+                 "\\hline"]
+        for model_name in model_names:
+            cells = []
+            for value in facet_values:
+                if model_name in facet_stats[value]:
+                    mean, std = self.mean_std(metric, facet, value, model_name, epoch_number)
+                    cells.append("{:.3f} $\\pm$ {:.3f}".format(mean, std))
+                else:
+                    cells.append("")
+            lines.append(model_name + " & " + " & ".join(cells) + " \\\\")
+        lines += ["\\hline", "\\end{tabular}", ""]
+        return "\n".join(lines)
+
+    def write_facet_tables(self, model_names: list, directory: str = '.', epoch_number: int = None):
+        """Write the <metric>_values_<facet>.txt tables for every summarized metric and facet after epoch_number
+        epochs. Without epoch_number, the tables of every epoch budget are written as
+        <metric>_values_<facet>-epochs-<epoch_number>.txt."""
+        for budget in (self.epoch_numbers() if epoch_number is None else [epoch_number]):
+            suffix = f"-epochs-{budget}" if epoch_number is None else ""
+            for metric, prefix in SUMMARY_FILE_PREFIXES.items():
+                for facet in self.stats.get(str(budget), {}).get(metric, {}):
+                    with open(os.path.join(directory, f"{prefix}_{facet}{suffix}.txt"), "w") as file:
+                        file.write(self.facet_table(metric, facet, model_names, budget))
+
+def _facet_sort_key(value: str):
+    """Sort numeric facet values numerically and all others alphabetically after them."""
+    try:
+        return (0, float(value), value)
+    except ValueError:
+        return (1, 0., value)
+
+# Function to generate cross validation dataset
+def generate_cross_validation_dataset(data, num_folds):
+    X, y = data.drop('target', axis=1).values, data['target'].values
+
+    dataset_list = []
+    kf = KFold(n_splits=num_folds)
+    fold = 0
+
+    # Splitting data into training and testing set for each fold in the cross-validation
+    for train_index, test_index in kf.split(X):
+        fold += 1
+        X_train, X_test = X[train_index], X[test_index]
+        y_train, y_test = y[train_index], y[test_index]
+
+        X_train, X_test = preprocess_data(X_train, X_test)
+        y_train, y_test = preprocess_target_values(y_train, y_test)
+
+        dataset_list.append((X_train, y_train, X_test, y_test , fold))
+
+    return dataset_list
+
+def evaluate_single_pass(model, X_test, y_test, batch_size=32):
+    """Evaluate a compiled model with one compiled inference pass over the test data.
+
+    Replaces model.evaluate followed by model.predict and the sklearn metrics: each batch is run once and
+    yields its predictions, its compiled loss and the sums for a streaming R² and MSE, accumulated in float64.
+
+    Args:
+        model: The compiled model.
+        X_test (np.ndarray): The test inputs.
+        y_test (np.ndarray): The test targets.
+        batch_size (int): The number of rows per compiled call. Defaults to 32, as in model.evaluate.
+
+    Returns:
+        (loss, predictions, r_squared_value, test_error), where the loss matches model.evaluate and the
+        metrics match sklearn's r2_score and mean_squared_error with uniform averaging over outputs.
+    """
+    step = _evaluation_steps.get(model)
+    if step is None:
+        # The step only holds a weak reference, a strong one would keep its own key alive in _evaluation_steps.
+        model_reference = weakref.ref(model)
+
+        @tf.function(reduce_retracing=True)
+        def step(inputs, targets):
+            model = model_reference()
+            predictions = model(inputs, training=False)
+            loss = model.compiled_loss(targets, predictions, regularization_losses=model.losses)
+            return predictions, loss
+        _evaluation_steps[model] = step
+
+    count, target_mean, target_m2, squared_error, loss_sum = 0, 0., 0., 0., 0.
+    predictions = []
+    for start in range(0, len(X_test), batch_size):
+        targets = y_test[start:start + batch_size]
+        batch_predictions, batch_loss = step(tf.constant(X_test[start:start + batch_size], dtype=tf.float32),
+                                             tf.constant(targets, dtype=tf.float32))
+        batch_predictions = batch_predictions.numpy()
+        predictions.append(batch_predictions)
+        targets = np.reshape(targets, batch_predictions.shape).astype(np.float64)
+
+        # Chan's parallel update of the target variance keeps the total sum of squares exact per batch.
+        batch_count = len(targets)
+        batch_mean = targets.mean(axis=0)
+        delta = batch_mean - target_mean
+        target_m2 += ((targets - batch_mean)**2).sum(axis=0) + delta**2 * count * batch_count / (count + batch_count)
+        target_mean += delta * batch_count / (count + batch_count)
+        count += batch_count
+        squared_error += ((targets - batch_predictions)**2).sum(axis=0)
+        # Like model.evaluate, batch losses are weighted by batch size.
+        loss_sum += float(batch_loss) * batch_count
+
+    r_squared_values = np.where(target_m2 > 0, 1. - squared_error / np.where(target_m2 > 0, target_m2, 1.),
+                                np.where(squared_error > 0, 0., 1.))
+    return loss_sum / count, np.concatenate(predictions), float(np.mean(r_squared_values)), float(np.mean(squared_error) / count)
+
+class EpochTimer(tf.keras.callbacks.Callback):
+    """Keras callback recording the wall-clock duration of every epoch of fit."""
+
+    def on_train_begin(self, logs=None):
+        self.epoch_times = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.perf_counter() - self._epoch_start)
+
+def _process_peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS; it covers the whole process, i.e. all threads.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024**2 if os.uname().sysname == 'Darwin' else peak / 1024
+
+def _current_rss_mb():
+    # The resident set size right now, from /proc on Linux; None where it is not available.
+    try:
+        with open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * resource.getpagesize() / 1024**2
+    except OSError:
+        return None
+
+def _append_telemetry(record: dict):
+    with _telemetry_lock:
+        with open(TELEMETRY_LOG, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+class MilestoneEvaluator(tf.keras.callbacks.Callback):
+    """Keras callback evaluating the test fold with evaluate_single_pass at the end of every milestone epoch."""
+
+    def __init__(self, X_test, y_test, milestones):
+        super(MilestoneEvaluator, self).__init__()
+        self.X_test, self.y_test = X_test, y_test
+        self.milestones = set(milestones)
+        self.snapshots = {}
+
+    def on_epoch_end(self, epoch, logs=None):
+        if epoch + 1 in self.milestones:
+            loss, _, r_squared_value, test_error = evaluate_single_pass(self.model, self.X_test, self.y_test)
+            self.snapshots[epoch + 1] = {'loss': loss, 'r_squared_value': r_squared_value, 'test_error': test_error}
+
+# Function to train and evaluate model
+def train_evaluate_model(model_tuple, fold_data, epoch_number, dataset_name, num_folds, summaries=None, metadata=None,
+                         validation_freq=1, validation_subsample=None, telemetry=None, batch_size=None):
+
+    model, name = model_tuple
+    X_train, y_train, X_test, y_test , fold = fold_data
+
+    # A list of epoch milestones trains once up to the last milestone and writes results for every milestone
+    milestones = sorted(set(epoch_number)) if isinstance(epoch_number, (list, tuple)) else [epoch_number]
+    epochs = milestones[-1]
+
+    # Phase timings in seconds, starting from those measured by the caller (construction, compile)
+    telemetry = dict(telemetry or {})
+    rss_start = telemetry.pop('rss_start_mb', None) or _current_rss_mb()
+
+    # Validate every validation_freq epochs (never when None), optionally on a fixed random subsample of the test fold
+    validation_data = None
+    if validation_freq:
+        validation_rows = np.arange(len(X_test))
+        if validation_subsample is not None and validation_subsample < len(X_test):
+            validation_rows = np.sort(np.random.default_rng(fold).choice(len(X_test), validation_subsample, replace=False))
+        validation_data = (X_test[validation_rows], y_test[validation_rows])
+
+    # Training the model
+    epoch_timer = EpochTimer()
+    milestone_evaluator = MilestoneEvaluator(X_test, y_test, milestones[:-1])
+    started = time.perf_counter()
+    history = model.fit(X_train,
+                        y_train,
+                        epochs=epochs,
+                        verbose=0,
+                        validation_data=validation_data,
+                        validation_freq=validation_freq or 1,
+                        batch_size=batch_size,
+                        callbacks=[epoch_timer, milestone_evaluator])
+    telemetry['fit'] = time.perf_counter() - started
+    telemetry['epochs'] = epoch_timer.epoch_times
+    # The first epoch also traces the train (and validation) functions, the later ones reuse them.
+    telemetry['trace'] = max(epoch_timer.epoch_times[0] - float(np.median(epoch_timer.epoch_times[1:])), 0.) \
+        if len(epoch_timer.epoch_times) > 1 else 0.
+
+     # Evaluating the trained model and making predictions on the test data in a single pass
+    started = time.perf_counter()
+    loss, predictions, r_squared_value, test_error = evaluate_single_pass(model, X_test, y_test)
+    telemetry['evaluation'] = time.perf_counter() - started
+    milestone_evaluator.snapshots[epochs] = {'loss': loss, 'r_squared_value': r_squared_value, 'test_error': test_error}
+
+    # Save results to numpy file
+    if not os.path.exists('aggregate_results'):
+        os.makedirs('aggregate_results')
+
+    started = time.perf_counter()
+    milestone_results = []
+    for milestone in milestones:
+        results = {
+            'model': name,
+            'fold': fold,
+            'train_history': history.history['loss'][:milestone],
+            'val_history': history.history.get('val_loss', [])[:milestone // (validation_freq or 1)],
+            **milestone_evaluator.snapshots[milestone],
+            'telemetry': telemetry}
+
+        np.save(f'aggregate_results/{dataset_name}-{name}-epochs-{milestone}-fold-{fold}-of-{num_folds}.npy', results)
+        milestone_results.append(results)
+    telemetry['result_write'] = time.perf_counter() - started
+    # Work units share the process, so the RSS growth over this unit also counts what concurrent units allocated
+    # meanwhile, and the process peak is the high-water mark of all of them so far.
+    rss_end = _current_rss_mb()
+    telemetry['rss_growth_mb'] = rss_end - rss_start if rss_start is not None and rss_end is not None else None
+    telemetry['process_peak_rss_mb'] = _process_peak_rss_mb()
+
+    # The telemetry log also holds the result write time, which the saved results cannot contain
+    _append_telemetry({'model': name, 'dataset': dataset_name, 'fold': fold, 'epoch_number': epochs, **telemetry})
+
+    # Fold the results of every milestone into the materialized summaries of its epoch budget
+    if summaries is not None:
+        for milestone, results in zip(milestones, milestone_results):
+            summaries.update(results, metadata if metadata is not None else {'dataset': dataset_name}, milestone)
+
+TELEMETRY_PHASES = ['construction', 'compile', 'trace', 'fit', 'evaluation', 'result_write']
+
+def telemetry_report(path=TELEMETRY_LOG, top=20):
+    """Rank the (model, dataset) pairs by their total time over all logged work units.
+
+    Returns:
+        A DataFrame with the summed time per phase (trace is part of fit), the total, the number of work
+        units, the largest RSS growth over one work unit and the process peak RSS reached by the pair's last
+        work unit, sorted from the costliest pair down and cut to `top` rows.
+    """
+    records = pd.read_json(path, lines=True)
+    for phase in TELEMETRY_PHASES:
+        if phase not in records:
+            records[phase] = 0.
+    records['total'] = records[[phase for phase in TELEMETRY_PHASES if phase != 'trace']].sum(axis=1)
+    report = records.groupby(['model', 'dataset']).agg(
+        **{phase: (phase, 'sum') for phase in TELEMETRY_PHASES + ['total']},
+        work_units=('fold', 'count'),
+        max_rss_growth_mb=('rss_growth_mb', 'max'),
+        process_peak_rss_mb=('process_peak_rss_mb', 'max'))
+    return report.sort_values('total', ascending=False).head(top)
+
+AUTOTUNE_CACHE = 'autotune_cache.json'
+
+def _autotune_worker(input_dimension, names, threads, batch_sizes, steps, results):
+    """Measure training throughput (samples per second) of every named model and batch size with `threads` intra-op threads."""
+    try:
+        # Only possible before the TensorFlow runtime starts, hence one fresh process per thread count.
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        zoo = ModelZoo(input_dimension)
+        rng = np.random.default_rng(0)
+        throughputs = {}
+        for name in names:
+            model = zoo.create(name, 0)
+            compile_models([(model, name)])
+            throughputs[name] = {}
+            for batch_size in batch_sizes:
+                X = rng.uniform(size=(batch_size * steps, input_dimension)).astype(np.float32)
+                y = rng.uniform(size=(batch_size * steps, 1)).astype(np.float32)
+                # The first fit traces the train function for this batch size.
+                model.fit(X[:2 * batch_size], y[:2 * batch_size], batch_size=batch_size, epochs=1, verbose=0)
+                started = time.perf_counter()
+                model.fit(X, y, batch_size=batch_size, epochs=1, verbose=0, shuffle=False)
+                throughputs[name][str(batch_size)] = len(X) / (time.perf_counter() - started)
+        results.put(('done', throughputs))
+    except Exception:
+        import traceback
+        results.put(('error', traceback.format_exc()))
+
+class Autotuner:
+    """Per-model batch size and intra-op thread count tuning by short training benchmarks on this machine.
+
+    Each thread count is benchmarked in a fresh process, since TensorFlow fixes its thread pools when its
+    runtime starts. The throughput of every (thread count, batch size) is cached in a JSON file per
+    (model class, hyperparameters, input dimension, host), so a machine only tunes each configuration once.
+    Concurrent callers are serialized, so a configuration is never benchmarked twice at the same time.
+
+    The runners only apply the tuned batch sizes, chosen for the thread count the process runs with.
+    TensorFlow cannot change its thread count once a model is built, so call configure_threads yourself
+    before the first model of the process is constructed.
+
+    Attributes:
+        path (str): The JSON cache file.
+        batch_sizes (list): The candidate batch sizes.
+        thread_counts (list): The candidate intra-op thread counts, by default powers of two up to the CPU count.
+        steps (int): The number of timed training steps per measurement.
+    """
+
+    def __init__(self, path=AUTOTUNE_CACHE, batch_sizes=(32, 64, 100, 128, 256), thread_counts=None, steps=20):
+        self.path = path
+        self.batch_sizes = list(batch_sizes)
+        cpus = os.cpu_count() or 1
+        self.thread_counts = list(thread_counts) if thread_counts is not None else \
+            sorted({2**power for power in range(cpus.bit_length()) if 2**power <= cpus} | {cpus})
+        self.steps = steps
+        self.cache = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path) as file:
+                self.cache = json.load(file)
+
+    @staticmethod
+    def _key(zoo, name) -> str:
+        # A zoo name and the zoo's hyperparameters fix the model class and configuration. Unlike a model
+        # signature, this key does not start the TensorFlow runtime, so configure_threads still works.
+        return json.dumps([socket.gethostname(), name, zoo.input_dimension, sorted(zoo.hyperparameters.items())])
+
+    def measure(self, input_dimension, names=None) -> dict:
+        """Return {name: {threads: {batch_size: samples per second}}}, benchmarking only what is not cached."""
+        zoo = model_zoo(input_dimension)
+        names = names if names is not None else zoo.names
+        signatures = {name: self._key(zoo, name) for name in names}
+        # Benchmarks running side by side would compete for the same cores and measure the wrong throughput.
+        with self._lock:
+            missing = [name for name in names
+                       if signatures[name] not in self.cache or
+                       any(str(threads) not in self.cache[signatures[name]] for threads in self.thread_counts)]
+            if missing:
+                context = multiprocessing.get_context('spawn')
+                for threads in self.thread_counts:
+                    results = context.Queue()
+                    worker = context.Process(target=_autotune_worker,
+                                             args=(input_dimension, missing, threads, self.batch_sizes, self.steps, results))
+                    worker.start()
+                    status, measured = self._worker_result(worker, results)
+                    worker.join()
+                    if status == 'error':
+                        raise RuntimeError(f"Autotuning benchmark failed:\n{measured}")
+                    for name, throughputs in measured.items():
+                        self.cache.setdefault(signatures[name], {})[str(threads)] = throughputs
+                # A temporary file of our own, so other processes tuning into the same cache never share it.
+                temporary_path = f"{self.path}.{os.getpid()}-{threading.get_ident()}.tmp"
+                with open(temporary_path, 'w') as file:
+                    json.dump(self.cache, file)
+                os.replace(temporary_path, self.path)
+            return {name: {int(threads): {int(batch_size): throughput for batch_size, throughput in table.items()}
+                           for threads, table in self.cache[signatures[name]].items()}
+                    for name in names}
+
+    @staticmethod
+    def _worker_result(worker, results, poll_seconds=1.):
+        # A worker killed by the OS (e.g. out of memory) or by a crashing kernel never reports back.
+        while True:
+            try:
+                return results.get(timeout=poll_seconds)
+            except queue.Empty:
+                if worker.is_alive():
+                    continue
+            # Whatever a worker put before exiting normally is flushed to the queue by then.
+            try:
+                return results.get(timeout=poll_seconds)
+            except queue.Empty:
+                raise RuntimeError(f"Autotuning benchmark process died with exit code {worker.exitcode} "
+                                   f"before reporting its measurements.") from None
+
+    def best(self, input_dimension, names=None) -> dict:
+        """Return the fastest {'threads', 'batch_size', 'throughput'} of every model on its own."""
+        settings = {}
+        for name, tables in self.measure(input_dimension, names).items():
+            threads, batch_size = max(((threads, batch_size) for threads, table in tables.items() for batch_size in table),
+                                      key=lambda setting: tables[setting[0]][setting[1]])
+            settings[name] = {'threads': threads, 'batch_size': batch_size, 'throughput': tables[threads][batch_size]}
+        return settings
+
+    def runner_settings(self, input_dimension, names=None) -> tuple:
+        """Return (threads, {name: batch_size}) for the runner, where all models share one process.
+
+        The shared thread count minimizes the summed time per training sample of all models, each at its
+        fastest batch size for that thread count.
+        """
+        tables = self.measure(input_dimension, names)
+        thread_counts = set.intersection(*[set(model_tables) for model_tables in tables.values()])
+        threads = min(thread_counts, key=lambda threads: sum(1. / max(model_tables[threads].values())
+                                                             for model_tables in tables.values()))
+        return threads, {name: max(model_tables[threads], key=model_tables[threads].get) for name, model_tables in tables.items()}
+
+    def tuned_batch_sizes(self, input_dimension, names=None, threads=None) -> dict:
+        """Return {name: batch_size}, the fastest batch size of every model at `threads` intra-op threads.
+
+        By default `threads` is the thread count this process actually runs with, so the batch sizes match
+        what configure_threads (or TensorFlow's default of one thread per core) put into effect.
+        """
+        if threads is None:
+            threads = tf.config.threading.get_intra_op_parallelism_threads() or os.cpu_count() or 1
+        tables = self.measure(input_dimension, names)
+        unmeasured = [name for name, model_tables in tables.items() if threads not in model_tables]
+        if unmeasured:
+            raise ValueError(f"No autotuning measurements at {threads} intra-op threads for {unmeasured}, "
+                             f"add {threads} to the Autotuner's thread_counts.")
+        return {name: max(model_tables[threads], key=model_tables[threads].get) for name, model_tables in tables.items()}
+
+    def configure_threads(self, input_dimension, names=None) -> int:
+        """Set this process' intra-op thread count to the runner setting. Must run before any model is built."""
+        threads, _ = self.runner_settings(input_dimension, names)
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        return threads
+
+# Function to evaluate models in parallel
+def model_zoo(input_dimension):
+    """Return the shared ModelZoo of an input dimension, created on first use."""
+    with _model_zoos_lock:
+        if input_dimension not in _model_zoos:
+            _model_zoos[input_dimension] = ModelZoo(input_dimension)
+        return _model_zoos[input_dimension]
+
+def evaluate_models_parallel(fold_data, dataset_name, epoch_number, num_folds, summaries=None, metadata=None, graph_cache=None,
+                             model_names=None, batch_sizes=None, validation_freq=1, validation_subsample=None):
+
+    # Only the requested models (all by default) are constructed, from the zoo of this input dimension
+    zoo = model_zoo(fold_data[0].shape[1])
+    names = model_names if model_names is not None else zoo.names
+    # Tuned batch sizes per model, Keras' default otherwise
+    batch_sizes = batch_sizes or {}
+    models, telemetry = [], {}
+    for name in names:
+        if graph_cache is None:
+            rss_start = _current_rss_mb()
+            started = time.perf_counter()
+            model_tuple = zoo.models(fold_data[4], [name])[0]
+            constructed = time.perf_counter()
+            compile_models([model_tuple])
+            telemetry[name] = {'construction': constructed - started, 'compile': time.perf_counter() - constructed,
+                               'rss_start_mb': rss_start}
+        else:
+            model_tuple = (None, name)
+        models.append(model_tuple)
+
+    def train_evaluate(model_tuple, *args):
+        if graph_cache is None:
+            try:
+                return train_evaluate_model(model_tuple, *args, validation_freq=validation_freq,
+                                            validation_subsample=validation_subsample, telemetry=telemetry[model_tuple[1]],
+                                            batch_size=batch_sizes.get(model_tuple[1]))
+            finally:
+                zoo.release(*model_tuple)
+        # Train a pooled model of the same signature whose graphs are already traced
+        acquired = {'rss_start_mb': _current_rss_mb()}
+        started = time.perf_counter()
+        model = zoo.acquire(model_tuple[1], fold_data[4], graph_cache, acquired)
+        # Compiling happens inside acquire when no pooled model is free, everything else is construction
+        acquired['construction'] = time.perf_counter() - started - acquired['compile']
+        try:
+            return train_evaluate_model((model, model_tuple[1]), *args, validation_freq=validation_freq,
+                                        validation_subsample=validation_subsample, telemetry=acquired,
+                                        batch_size=batch_sizes.get(model_tuple[1]))
+        finally:
+            graph_cache.release(model)
+
+     # Training and evaluating all models in parallel using ThreadPoolExecutor
+    with ThreadPoolExecutor() as executor:
+        futures = {executor.submit(train_evaluate,
+                                   model,
+                                   fold_data,
+                                   epoch_number,
+                                   dataset_name,
+                                   num_folds,
+                                   summaries,
+                                   metadata): model for model in models}
+        for future in futures:
+            future.result()  # Just to make sure all tasks are finished
+
+# Function to evaluate all folds in parallel
+def evaluate_all_folds_parallel(kfold_datasets, dataset_name, epoch_number, num_folds, summaries=None, metadata=None, graph_cache=None,
+                                model_names=None, batch_sizes=None, validation_freq=1, validation_subsample=None):
+
+     # Evaluating all folds in parallel using ThreadPoolExecutor
+    with ThreadPoolExecutor() as executor:
+        futures = {executor.submit(evaluate_models_parallel,
+                                   fold_data,
+                                   dataset_name,
+                                   epoch_number,
+                                   num_folds,
+                                   summaries,
+                                   metadata,
+                                   graph_cache,
+                                   model_names,
+                                   batch_sizes,
+                                   validation_freq,
+                                   validation_subsample): fold_data for fold_data in kfold_datasets}
+        for future in futures:
+            future.result()  # Just to make sure all tasks are finished
+
+def _tuned_batch_sizes(autotuner, kfold_datasets, model_names):
+    # Resolved once per dataset before its folds are dispatched, so only one benchmark ever runs at a time,
+    # and at the thread count the process runs with, whatever dimension configure_threads was tuned for.
+    if autotuner is None:
+        return None
+    return autotuner.tuned_batch_sizes(kfold_datasets[0][0].shape[1], model_names)
+
+# Retrieve all datasets and their names and feed them to the evaluation functions with a for loop.
+def retrieve_datasets_and_run_evaluations(num_folds=5, epoch_number=100, summaries=None, graph_cache=None, model_names=None,
+                                          autotuner=None, validation_freq=1, validation_subsample=None):
+    # Fetching data
+    filtered_datasets_metadata, datasets = fetch_return_filtered_pmlb_data_sets()
+
+    for dataset, row in zip(datasets, filtered_datasets_metadata.iterrows()):
+        dataset_name = row[1]['dataset']
+        kfold_datasets = generate_cross_validation_dataset(dataset, num_folds)
+        evaluate_all_folds_parallel(kfold_datasets, dataset_name, epoch_number, num_folds,
+                                    summaries, row[1].to_dict(), graph_cache, model_names,
+                                    _tuned_batch_sizes(autotuner, kfold_datasets, model_names),
+                                    validation_freq, validation_subsample)
+
+def prepare_datasets_in_background(num_folds=5, prefetch=2, metadata=None):
+    """Fetch datasets and generate their preprocessed folds on a background thread.
+
+    At most `prefetch` prepared datasets wait in a bounded queue, so fetching and preprocessing the next
+    datasets overlaps with training on the current one without holding every dataset in memory.
+
+    Args:
+        num_folds (int): Number of cross-validation folds per dataset. Defaults to 5.
+        prefetch (int): Maximum number of prepared datasets waiting to be trained on. Defaults to 2.
+        metadata (pd.DataFrame): The dataset metadata rows to prepare. Defaults to filter_pmlb_metadata().
+
+    Yields:
+        (metadata_row, kfold_datasets) tuples in metadata order. Errors in the background stage are re-raised here.
+    """
+    if metadata is None:
+        metadata = filter_pmlb_metadata()
+    prepared = queue.Queue(maxsize=prefetch)
+    stop = threading.Event()
+    end_of_datasets = object()
+
+    def put(item):
+        # Give up when the consumer stopped early instead of blocking on a full queue forever.
+        while not stop.is_set():
+            try:
+                prepared.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for _, row in metadata.iterrows():
+                kfold_datasets = generate_cross_validation_dataset(pmlb.fetch_data(row['dataset']), num_folds)
+                if not put((row.to_dict(), kfold_datasets)):
+                    return
+            put(end_of_datasets)
+        except BaseException as error:
+            put(error)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    try:
+        while True:
+            item = prepared.get()
+            if item is end_of_datasets:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        producer.join()
+
+# Same as retrieve_datasets_and_run_evaluations, but the next datasets are fetched and split while the current one trains.
+def retrieve_datasets_and_run_evaluations_pipelined(num_folds=5, epoch_number=100, summaries=None, prefetch=2, graph_cache=None,
+                                                    model_names=None, autotuner=None, validation_freq=1, validation_subsample=None):
+    for metadata_row, kfold_datasets in prepare_datasets_in_background(num_folds, prefetch):
+        evaluate_all_folds_parallel(kfold_datasets, metadata_row['dataset'], epoch_number, num_folds,
+                                    summaries, metadata_row, graph_cache, model_names,
+                                    _tuned_batch_sizes(autotuner, kfold_datasets, model_names),
+                                    validation_freq, validation_subsample)
+
+# Retrain the quantizable models on every fold and report the accuracy change of their quantized copies.
+def run_quantization_benchmark(num_folds=5, epoch_number=100, dtypes=('int8', 'float16')):
+    filtered_datasets_metadata, datasets = fetch_return_filtered_pmlb_data_sets()
+
+    records = []
+    for dataset, row in zip(datasets, filtered_datasets_metadata.iterrows()):
+        dataset_name = row[1]['dataset']
+        for X_train, y_train, X_test, y_test, fold in generate_cross_validation_dataset(dataset, num_folds):
+            models = [(model, name) for model, name in initialize_all_models(X_train.shape[1], seed_val=fold)
+                      if isinstance(model, (SplineANN, LookupTableModel, ABELSpline))]
+            compile_models(models)
+            for model, name in models:
+                model.fit(X_train, y_train, epochs=epoch_number, verbose=0)
+                for dtype in dtypes:
+                    report = quantization_report(model, quantize_model(model, dtype), X_test, y_test)
+                    records.append({'dataset': dataset_name, 'fold': fold, 'model': name, 'dtype': dtype, **report})
+
+    return pd.DataFrame(records)
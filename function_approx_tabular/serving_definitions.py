@@ -0,0 +1,181 @@
+import asyncio
+import json
+import time
+import numpy as np
+import tensorflow as tf
+from model_data_definitions import *
+
+class MicroBatchingPredictor:
+    """Serve predictions of a trained model to many concurrent callers by coalescing their requests into
+    micro-batches. Each batch is one call of a compiled inference function, so single-row requests no longer
+    pay the per-call overhead of model.predict.
+
+    A batch is dispatched as soon as it holds max_batch_size rows or max_wait seconds have passed since its
+    first request arrived, whichever comes first. A request that would overflow the batch starts the next
+    one, so batches never exceed max_batch_size unless a single request is larger on its own.
+
+    Attributes:
+        model: The trained model, e.g. an ABELSpline, SplineANN or one of the Sequential ANNs.
+        input_dim (int): The number of input features of the model.
+        max_batch_size (int): The most rows evaluated in one inference call.
+        max_wait (float): The longest a request waits for others to join its batch, in seconds.
+        latencies (list): Seconds from submission to result, one per served request.
+        batch_sizes (list): The number of rows of every dispatched batch.
+    """
+
+    def __init__(self, model, max_batch_size: int = 256, max_wait: float = 0.002):
+        self.model = model
+        self.input_dim = getattr(model, 'input_dim', None) or model.input_shape[-1]
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.latencies = []
+        self.batch_sizes = []
+        # A dynamic batch dimension keeps every batch size on the same trace.
+        self._infer = tf.function(lambda inputs: model(inputs, training=False),
+                                  input_signature=[tf.TensorSpec([None, self.input_dim], tf.float32)])
+        self._queue = None
+        self._worker = None
+        self._started = None
+
+    async def start(self):
+        """Start the batching worker on the running event loop and trace the inference function once."""
+        self._infer(tf.zeros((1, self.input_dim)))
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._serve())
+        self._started = time.perf_counter()
+
+    async def stop(self):
+        """Stop the batching worker once it has answered every queued request."""
+        await self._queue.put(None)
+        await self._worker
+
+    async def predict(self, inputs) -> np.ndarray:
+        """Return the model's predictions for one input row or a small block of rows."""
+        inputs = np.asarray(inputs, dtype=np.float32).reshape(-1, self.input_dim)
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((inputs, future, time.perf_counter()))
+        return await future
+
+    async def _serve(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        overflow = None
+        while not stopping:
+            request = overflow if overflow is not None else await self._queue.get()
+            overflow = None
+            if request is None:
+                break
+            batch, rows = [request], len(request[0])
+            deadline = request[2] + self.max_wait
+            while rows < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self._queue.get_nowait() if timeout <= 0 else await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                if rows + len(request[0]) > self.max_batch_size:
+                    overflow = request
+                    break
+                batch.append(request)
+                rows += len(request[0])
+            # Run the inference off the event loop so callers can keep queueing the next batch.
+            inputs = np.concatenate([inputs for inputs, _, _ in batch])
+            try:
+                predictions = await loop.run_in_executor(None, lambda: self._infer(inputs).numpy())
+            except Exception as error:
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            finished = time.perf_counter()
+            self.batch_sizes.append(rows)
+            start = 0
+            for inputs, future, submitted in batch:
+                # A caller that gave up waiting (its predict was cancelled) is skipped, not answered.
+                if not future.done():
+                    future.set_result(predictions[start:start + len(inputs)])
+                    self.latencies.append(finished - submitted)
+                start += len(inputs)
+
+    def statistics(self) -> dict:
+        """Return the latency percentiles (in milliseconds), throughput (requests per second) and mean batch size."""
+        latencies = np.array(self.latencies) * 1000.
+        elapsed = time.perf_counter() - self._started
+        return {'requests': len(latencies),
+                'latency_p50_ms': float(np.percentile(latencies, 50)),
+                'latency_p90_ms': float(np.percentile(latencies, 90)),
+                'latency_p99_ms': float(np.percentile(latencies, 99)),
+                'throughput': len(latencies) / elapsed,
+                'mean_batch_size': float(np.mean(self.batch_sizes))}
+
+async def serve_predictions(predictor: MicroBatchingPredictor, host: str = '127.0.0.1', port: int = 8765):
+    """Expose a started predictor over TCP. Each request and response is one line of JSON: a list of input
+    rows in, a list of prediction rows out."""
+
+    async def handle(reader, writer):
+        while line := await reader.readline():
+            predictions = await predictor.predict(json.loads(line))
+            writer.write((json.dumps(predictions.tolist()) + '\n').encode())
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, host, port)
+
+async def _generate_load(host: str, port: int, inputs: np.ndarray, concurrency: int, num_requests: int) -> list:
+    """Send num_requests single-row requests from `concurrency` localhost clients and return their latencies."""
+    latencies = []
+
+    async def client(requests):
+        reader, writer = await asyncio.open_connection(host, port)
+        for index in requests:
+            submitted = time.perf_counter()
+            writer.write((json.dumps([inputs[index % len(inputs)].tolist()]) + '\n').encode())
+            await writer.drain()
+            await reader.readline()
+            latencies.append(time.perf_counter() - submitted)
+        writer.close()
+        await writer.wait_closed()
+
+    await asyncio.gather(*[client(range(client_index, num_requests, concurrency)) for client_index in range(concurrency)])
+    return latencies
+
+def benchmark_prediction_service(model, inputs: np.ndarray, num_requests: int = 2000, concurrency: int = 64,
+                                 max_batch_size: int = 256, max_wait: float = 0.002,
+                                 host: str = '127.0.0.1', port: int = 8765) -> dict:
+    """Benchmark a micro-batching prediction service for a model with a load generator on localhost.
+
+    Args:
+        model: The trained model to serve.
+        inputs (np.ndarray): Rows the clients draw their single-row requests from.
+        num_requests (int): Total number of requests. Defaults to 2000.
+        concurrency (int): Number of concurrent clients. Defaults to 64.
+        max_batch_size (int): Largest micro-batch. Defaults to 256.
+        max_wait (float): Longest a request waits for its batch to fill, in seconds. Defaults to 0.002.
+        host (str): Address to serve on. Defaults to '127.0.0.1'.
+        port (int): Port to serve on. Defaults to 8765.
+
+    Returns:
+        The client-side latency percentiles (ms) and throughput, next to the service's own statistics.
+    """
+
+    async def run():
+        predictor = MicroBatchingPredictor(model, max_batch_size, max_wait)
+        await predictor.start()
+        server = await serve_predictions(predictor, host, port)
+        started = time.perf_counter()
+        latencies = await _generate_load(host, port, inputs, concurrency, num_requests)
+        elapsed = time.perf_counter() - started
+        server.close()
+        await server.wait_closed()
+        await predictor.stop()
+        latencies = np.array(latencies) * 1000.
+        return {'client_latency_p50_ms': float(np.percentile(latencies, 50)),
+                'client_latency_p90_ms': float(np.percentile(latencies, 90)),
+                'client_latency_p99_ms': float(np.percentile(latencies, 99)),
+                'client_throughput': num_requests / elapsed,
+                'service': predictor.statistics()}
+
+    return asyncio.run(run())
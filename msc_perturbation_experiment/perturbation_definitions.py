@@ -0,0 +1,475 @@
+import json
+import os
+from collections.abc import Mapping
+import numpy as np
+import scipy.sparse
+import tensorflow as tf
+
+def create_probe_points(input_dim: int, num_points: int, seed_val: int) -> np.ndarray:
+    """Sample points uniformly over [0,1]^n, used both as update points and as probe points."""
+    rng = np.random.default_rng(seed_val)
+    return rng.uniform(0, 1, size=(num_points, input_dim)).astype(np.float32)
+
+def create_probe_grid(input_dim: int, points_per_dim: int) -> np.ndarray:
+    """Create a regular grid of points_per_dim**input_dim probe points over [0,1]^n."""
+    axes = [np.linspace(0, 1, points_per_dim)] * input_dim
+    grid = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1)
+    return grid.reshape(-1, input_dim).astype(np.float32)
+
+def _as_dense(gradient):
+    """Convert sparse (IndexedSlices) gradients, e.g. of the Embedding control points, to dense tensors."""
+    return tf.convert_to_tensor(gradient)
+
+def create_perturbation_function(model: tf.keras.Model,
+                                 optimizer: str = 'sgd',
+                                 learning_rate: float = 0.001,
+                                 steps: int = 1,
+                                 loss='mean_absolute_error',
+                                 beta_1: float = 0.9,
+                                 beta_2: float = 0.999,
+                                 epsilon: float = 1e-7):
+    """Create a compiled function measuring the change in output caused by single-point updates.
+
+    For every update point the returned function trains a copy of the current weights for the given
+    number of steps on that single point (plus any rehearsal points), evaluates the model on the probe
+    points and restores the original weights. All update points are handled inside one compiled call.
+    The optimizer state is fresh for every update point, as if a newly compiled model was trained.
+
+    Args:
+        model: The model to perturb. Its weights are unchanged after each call.
+        optimizer: Either 'sgd' or 'adam'. Defaults to 'sgd'.
+        learning_rate: The learning rate of the update. Defaults to 0.001.
+        steps: The number of optimizer steps per update point. Defaults to 1.
+        loss: The loss identifier. Defaults to 'mean_absolute_error'.
+        beta_1: Adam first moment decay. Defaults to 0.9.
+        beta_2: Adam second moment decay. Defaults to 0.999.
+        epsilon: Adam numerical stability constant. Defaults to 1e-7.
+
+    Returns:
+        A tf.function taking (update_points, update_targets, probe_points, rehearsal_points) and
+        returning the output changes with shape [num_update_points, num_probe_points, output_dim].
+    """
+    if optimizer not in ('sgd', 'adam'):
+        raise ValueError(f"Unknown optimizer '{optimizer}', expected 'sgd' or 'adam'.")
+    loss_fn = tf.keras.losses.get(loss)
+    variables = model.trainable_variables
+
+    def apply_updates(point, target, rehearsal_points, rehearsal_targets):
+        x = tf.concat([point[tf.newaxis], rehearsal_points], axis=0)
+        y = tf.concat([target[tf.newaxis], rehearsal_targets], axis=0)
+        first_moments = [tf.zeros_like(v) for v in variables]
+        second_moments = [tf.zeros_like(v) for v in variables]
+        for step in range(1, steps + 1):
+            with tf.GradientTape() as tape:
+                step_loss = tf.reduce_mean(loss_fn(y, model(x, training=True)))
+            gradients = [_as_dense(g) for g in tape.gradient(step_loss, variables)]
+            for i, (variable, gradient) in enumerate(zip(variables, gradients)):
+                if optimizer == 'sgd':
+                    variable.assign_sub(learning_rate * gradient)
+                else:
+                    first_moments[i] = beta_1 * first_moments[i] + (1. - beta_1) * gradient
+                    second_moments[i] = beta_2 * second_moments[i] + (1. - beta_2) * gradient**2
+                    corrected_rate = learning_rate * np.sqrt(1. - beta_2**step) / (1. - beta_1**step)
+                    variable.assign_sub(corrected_rate * first_moments[i] / (tf.sqrt(second_moments[i]) + epsilon))
+
+    @tf.function
+    def perturb(update_points, update_targets, probe_points, rehearsal_points):
+        original_values = [tf.identity(v) for v in variables]
+        outputs_before = model(probe_points)
+        rehearsal_targets = model(rehearsal_points)
+
+        changes = tf.TensorArray(tf.float32, size=tf.shape(update_points)[0])
+        for i in tf.range(tf.shape(update_points)[0]):
+            apply_updates(update_points[i], update_targets[i], rehearsal_points, rehearsal_targets)
+            changes = changes.write(i, model(probe_points) - outputs_before)
+            for variable, value in zip(variables, original_values):
+                variable.assign(value)
+        return changes.stack()
+
+    return perturb
+
+def summarize_perturbations(changes, update_points, probe_points, tolerance: float = 1e-3) -> dict:
+    """Compute how much and how far each single-point update changed the output.
+
+    Args:
+        changes: Output changes of shape [num_update_points, num_probe_points, output_dim].
+        update_points: The update points of shape [num_update_points, input_dim].
+        probe_points: The probe points of shape [num_probe_points, input_dim].
+        tolerance: Absolute change above which a probe point counts as affected. Defaults to 1e-3.
+
+    Returns:
+        A dict of per update point arrays: 'max_change' and 'mean_change' (absolute output change over the
+        probe points), 'affected_fraction' (fraction of affected probe points) and 'min_distance' (the smallest
+        radius around the update point beyond which no probe point is affected).
+    """
+    absolute_changes = tf.reduce_max(tf.abs(changes), axis=-1)
+    distances = tf.norm(update_points[:, tf.newaxis, :] - probe_points[tf.newaxis, :, :], axis=-1)
+    affected = absolute_changes > tolerance
+    return {
+        'max_change': tf.reduce_max(absolute_changes, axis=1).numpy(),
+        'mean_change': tf.reduce_mean(absolute_changes, axis=1).numpy(),
+        'affected_fraction': tf.reduce_mean(tf.cast(affected, tf.float32), axis=1).numpy(),
+        'min_distance': tf.reduce_max(tf.where(affected, distances, tf.zeros_like(distances)), axis=1).numpy()
+    }
+
+def measure_perturbations(models: list,
+                          update_points: np.ndarray,
+                          probe_points: np.ndarray,
+                          optimizer: str = 'sgd',
+                          learning_rate: float = 0.001,
+                          steps: int = 1,
+                          perturbation: float = 1.,
+                          rehearsal_points: np.ndarray = None,
+                          tolerance: float = 1e-3) -> dict:
+    """Measure the effect of single-point updates for several models with one compiled call per model.
+
+    Each update point is trained towards the model's current output there plus the perturbation.
+
+    Args:
+        models: A list of (model, name) tuples, as returned by initialize_all_models.
+        update_points: The points to update at, shape [num_update_points, input_dim].
+        probe_points: The points to measure the change at, shape [num_probe_points, input_dim].
+        optimizer: Either 'sgd' or 'adam'. Defaults to 'sgd'.
+        learning_rate: The learning rate of the update. Defaults to 0.001.
+        steps: The number of optimizer steps per update point. Defaults to 1.
+        perturbation: The offset added to the current output to get the update target. Defaults to 1.
+        rehearsal_points: Optional pseudorehearsal points trained on alongside every update point, with the
+            model's outputs before the update as targets. Defaults to None.
+        tolerance: Absolute change above which a probe point counts as affected. Defaults to 1e-3.
+
+    Returns:
+        A dict mapping model names to the output of summarize_perturbations.
+    """
+    update_points = tf.constant(update_points, dtype=tf.float32)
+    probe_points = tf.constant(probe_points, dtype=tf.float32)
+    if rehearsal_points is None:
+        rehearsal_points = np.zeros((0, update_points.shape[1]))
+    rehearsal_points = tf.constant(rehearsal_points, dtype=tf.float32)
+
+    results = {}
+    for model, name in models:
+        update_targets = model(update_points) + perturbation
+        perturb = create_perturbation_function(model, optimizer, learning_rate, steps)
+        changes = perturb(update_points, update_targets, probe_points, rehearsal_points)
+        results[name] = summarize_perturbations(changes, update_points, probe_points, tolerance)
+    return results
+
+def _summary_statistics(values) -> dict:
+    return {'mean': float(np.mean(values)), 'std': float(np.std(values)),
+            'min': float(np.min(values)), 'max': float(np.max(values))}
+
+def run_perturbation_sweep(model_builder,
+                           input_dims: list = [1,2,4,6],
+                           pseudo_rehearsal_flags: list = [False, True],
+                           optimizers: list = ['adam', 'sgd'],
+                           num_update_points: int = 100,
+                           num_probe_points: int = 10000,
+                           num_rehearsal_samples: int = 100,
+                           learning_rate: float = 0.001,
+                           steps: int = 10,
+                           seed_val: int = 0,
+                           tolerance: float = 1e-3,
+                           records_path: str = None):
+    """Run single-point perturbations over input dimensions, pseudorehearsal and optimizers.
+
+    Pseudorehearsal targets equal the model's own outputs, so they only affect the update after its
+    first step, hence the default of several steps per update point.
+
+    Args:
+        model_builder: Called with an input dimension, returns a list of (model, name) tuples.
+        input_dims: The input dimensions to sweep over. Defaults to [1,2,4,6].
+        pseudo_rehearsal_flags: Whether to train on pseudorehearsal samples. Defaults to [False, True].
+        optimizers: The optimizers to sweep over. Defaults to ['adam', 'sgd'].
+        num_update_points: The number of single-point updates per configuration. Defaults to 100.
+        num_probe_points: The number of probe points per configuration. Defaults to 10000.
+        num_rehearsal_samples: The number of pseudorehearsal samples. Defaults to 100.
+        learning_rate: The learning rate of the update. Defaults to 0.001.
+        steps: The number of optimizer steps per update point. Defaults to 10.
+        seed_val: Seed for the update, probe and rehearsal points, recorded as the trial. Defaults to 0.
+        tolerance: Absolute change above which a probe point counts as affected. Defaults to 1e-3.
+        records_path: Optional JSON lines file every finished configuration is appended to as soon as it
+            is measured. Configurations already in the file for this trial are skipped, so an interrupted
+            sweep resumes where it stopped. Defaults to None.
+
+    Returns:
+        A dict mapping model names to nested dicts of the form
+        results[input_dim][pseudo_rehearsal][optimizer][metric] = {'mean', 'std', 'min', 'max'},
+        with JSON style string keys (e.g. '2', 'false', 'adam'). With records_path, the PerturbationRecords
+        view of the whole file is returned instead.
+    """
+    writer = PerturbationRecordWriter(records_path) if records_path is not None else None
+    results = {}
+    for input_dim in input_dims:
+        update_points = create_probe_points(input_dim, num_update_points, seed_val)
+        probe_points = create_probe_points(input_dim, num_probe_points, seed_val + 1)
+        models = None
+        for pseudo_rehearsal in pseudo_rehearsal_flags:
+            rehearsal_points = create_probe_points(input_dim, num_rehearsal_samples, seed_val + 2) if pseudo_rehearsal else None
+            for optimizer in optimizers:
+                if writer is not None and writer.has_configuration(input_dim, pseudo_rehearsal, optimizer, seed_val):
+                    continue
+                # Models are only built for dimensions that still have configurations left to measure.
+                models = model_builder(input_dim) if models is None else models
+                measurements = measure_perturbations(models, update_points, probe_points,
+                                                     optimizer=optimizer,
+                                                     learning_rate=learning_rate,
+                                                     steps=steps,
+                                                     rehearsal_points=rehearsal_points,
+                                                     tolerance=tolerance)
+                for name, metrics in measurements.items():
+                    statistics = {metric: _summary_statistics(values) for metric, values in metrics.items()}
+                    entry = results.setdefault(name, {}).setdefault(str(input_dim), {})
+                    entry.setdefault(json.dumps(pseudo_rehearsal), {})[optimizer] = statistics
+                    if writer is not None:
+                        writer.append(name, input_dim, pseudo_rehearsal, optimizer, seed_val, statistics)
+                if writer is not None:
+                    writer.mark_configuration(input_dim, pseudo_rehearsal, optimizer, seed_val)
+    return PerturbationRecords(records_path) if writer is not None else results
+
+def load_perturbation_records(path: str):
+    """Yield the records of a perturbation records file in the order they were written.
+
+    A line cut short by a crash during an append is skipped.
+    """
+    if not os.path.exists(path):
+        return
+    with open(path) as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if line.endswith('\n'):
+                yield record
+
+class PerturbationRecordWriter:
+    """Append-only writer for perturbation results, one JSON line per (model, input dimension,
+    pseudorehearsal flag, optimizer, trial).
+
+    Every record is written with a single append to a file opened with O_APPEND and synced to disk before
+    append returns, so an interrupted sweep loses at most the record being written and readers never see
+    a partial record except possibly as the final, unterminated line. Once every model of a configuration
+    is written, a 'configuration_done' record marks the configuration as complete.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._truncate_partial_record()
+        self.completed = {self._key(record['input_dim'], record['pseudo_rehearsal'], record['optimizer'], record['trial'])
+                          for record in load_perturbation_records(path) if record.get('configuration_done')}
+
+    @staticmethod
+    def _key(input_dim, pseudo_rehearsal, optimizer, trial) -> tuple:
+        return (str(input_dim), json.dumps(pseudo_rehearsal) if isinstance(pseudo_rehearsal, bool) else pseudo_rehearsal,
+                optimizer, trial)
+
+    def _truncate_partial_record(self):
+        # Drop the tail of a record cut short by a crash, so the next append starts on a fresh line.
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as file:
+            content = file.read()
+            if content and not content.endswith(b'\n'):
+                file.truncate(content.rfind(b'\n') + 1)
+
+    def _write(self, record: dict):
+        file_descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(file_descriptor, (json.dumps(record) + '\n').encode())
+            os.fsync(file_descriptor)
+        finally:
+            os.close(file_descriptor)
+
+    def append(self, model_name: str, input_dim: int, pseudo_rehearsal: bool, optimizer: str, trial: int, statistics: dict):
+        """Append the metric statistics of one model for one configuration and trial."""
+        self._write({'model': model_name, 'input_dim': str(input_dim), 'pseudo_rehearsal': json.dumps(pseudo_rehearsal),
+                     'optimizer': optimizer, 'trial': trial, 'metrics': statistics})
+
+    def mark_configuration(self, input_dim: int, pseudo_rehearsal: bool, optimizer: str, trial: int):
+        """Record that every model of a configuration and trial has been written."""
+        key = self._key(input_dim, pseudo_rehearsal, optimizer, trial)
+        self._write(dict(zip(['input_dim', 'pseudo_rehearsal', 'optimizer', 'trial'], key), configuration_done=True))
+        self.completed.add(key)
+
+    def has_configuration(self, input_dim: int, pseudo_rehearsal: bool, optimizer: str, trial: int) -> bool:
+        return self._key(input_dim, pseudo_rehearsal, optimizer, trial) in self.completed
+
+def _pool_trials(trials: list) -> dict:
+    """Combine per-trial statistics over equally sized trials into statistics over all their update points."""
+    means = np.array([trial['mean'] for trial in trials])
+    second_moments = np.array([trial['std']**2 + trial['mean']**2 for trial in trials])
+    mean = float(np.mean(means))
+    return {'mean': mean, 'std': float(np.sqrt(max(np.mean(second_moments) - mean**2, 0.))),
+            'min': min(trial['min'] for trial in trials), 'max': max(trial['max'] for trial in trials)}
+
+class PerturbationRecords(Mapping):
+    """Read-only nested view of a perturbation records file, in the layout returned by run_perturbation_sweep:
+    view[model][input_dim][pseudo_rehearsal][optimizer][metric] = {'mean', 'std', 'min', 'max'}.
+
+    The view is rebuilt on access whenever the file has grown, so a sweep that is still running can be
+    aggregated at any time. Statistics of several trials of the same configuration are pooled.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._size = None
+        self._nested = {}
+
+    def _refresh(self) -> dict:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size != self._size:
+            trials = {}
+            for record in load_perturbation_records(self.path):
+                if 'model' in record:
+                    key = (record['model'], record['input_dim'], record['pseudo_rehearsal'], record['optimizer'])
+                    trials.setdefault(key, {})[record['trial']] = record['metrics']
+            nested = {}
+            for (model_name, input_dim, pseudo_rehearsal, optimizer), metrics_per_trial in trials.items():
+                entry = nested.setdefault(model_name, {}).setdefault(input_dim, {}).setdefault(pseudo_rehearsal, {})
+                entry[optimizer] = {metric: _pool_trials([metrics[metric] for metrics in metrics_per_trial.values()])
+                                    for metric in next(iter(metrics_per_trial.values()))}
+            self._nested, self._size = nested, size
+        return self._nested
+
+    def __getitem__(self, model_name):
+        return self._refresh()[model_name]
+
+    def __iter__(self):
+        return iter(self._refresh())
+
+    def __len__(self):
+        return len(self._refresh())
+
+    def export_json(self, json_path: str, model_name: str = None):
+        """Atomically write the nested view, or one model's part of it, as a single JSON file
+        (e.g. aggregated_perturbation_data.json)."""
+        nested = self._refresh()
+        temporary_path = json_path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(nested[model_name] if model_name is not None else nested, file)
+        os.replace(temporary_path, json_path)
+
+def _output_gradients(model, inputs, targets, loss):
+    """Gradient of each example's loss w.r.t. the model output, or ones to differentiate the output itself."""
+    outputs = model(inputs)
+    if targets is None:
+        return tf.ones_like(outputs)
+    loss_fn = tf.keras.losses.get(loss)
+    with tf.GradientTape() as tape:
+        tape.watch(outputs)
+        total_loss = tf.reduce_sum(loss_fn(tf.reshape(tf.cast(targets, tf.float32), tf.shape(outputs)), outputs))
+    return tape.gradient(total_loss, outputs)
+
+def _sparse_rows(columns, values, num_columns: int) -> scipy.sparse.csr_matrix:
+    """Assemble a CSR matrix with the same number of non-zeros in every row."""
+    num_rows, row_length = columns.shape
+    indptr = np.arange(0, num_rows * row_length + 1, row_length)
+    return scipy.sparse.csr_matrix((values.ravel(), columns.ravel(), indptr), shape=(num_rows, num_columns))
+
+def _spline_ann_gradients(spline_ann, inputs, output_gradients) -> scipy.sparse.csr_matrix:
+    """Per-example gradients w.r.t. the control points of a SplineANN, given the gradients w.r.t. its output."""
+    spline_values, indices = spline_ann.spline_basis(inputs)
+    output_gradients = np.asarray(output_gradients)
+    output_dim = output_gradients.shape[1]
+    values = np.asarray(spline_values)[:, :, np.newaxis] * output_gradients[:, np.newaxis, :]
+    columns = np.asarray(indices)[:, :, np.newaxis] * output_dim + np.arange(output_dim)
+    num_columns = int(np.prod(spline_ann.control_points.embeddings.shape))
+    return _sparse_rows(columns.reshape(len(values), -1), values.reshape(len(values), -1), num_columns)
+
+def _abel_spline_gradients(abel_spline, inputs, output_gradients) -> scipy.sparse.csr_matrix:
+    """Per-example gradients of an ABELSpline, direct SAM control points first, then the indirect ones."""
+    direct_gradients = _spline_ann_gradients(abel_spline.direct_sam, inputs, output_gradients)
+    if abel_spline.num_exps == 0:
+        return direct_gradients
+    indirect_outputs = abel_spline.indirect_sam(inputs)
+    with tf.GradientTape() as tape:
+        tape.watch(indirect_outputs)
+        exponentials = abel_spline.anti_symmetric_exponential_layer(indirect_outputs)
+    indirect_output_gradients = tape.gradient(exponentials, indirect_outputs, output_gradients=output_gradients)
+    indirect_gradients = _spline_ann_gradients(abel_spline.indirect_sam, inputs, indirect_output_gradients)
+    return scipy.sparse.hstack([direct_gradients, indirect_gradients], format='csr')
+
+def _lookup_table_gradients(lookup_table, inputs, output_gradients) -> scipy.sparse.csr_matrix:
+    """Per-example gradients of a LookupTableModel, each example only touches its own cell."""
+    output_gradients = np.asarray(output_gradients)
+    output_dim = output_gradients.shape[1]
+    columns = np.asarray(lookup_table.cell_indices(inputs))[:, np.newaxis] * output_dim + np.arange(output_dim)
+    num_columns = int(np.prod(lookup_table.embedding.embeddings.shape))
+    return _sparse_rows(columns, output_gradients, num_columns)
+
+def _dense_gradients(model, inputs, targets, loss) -> np.ndarray:
+    """Per-example gradients of any model through a vectorized jacobian, flattened and concatenated."""
+    with tf.GradientTape() as tape:
+        outputs = model(inputs)
+        if targets is None:
+            per_example = tf.reduce_sum(outputs, axis=-1)
+        else:
+            per_example = tf.keras.losses.get(loss)(tf.reshape(tf.cast(targets, tf.float32), tf.shape(outputs)), outputs)
+    jacobians = tape.jacobian(per_example, model.trainable_variables, experimental_use_pfor=True)
+    return np.concatenate([tf.reshape(j, (len(inputs), -1)).numpy() for j in jacobians], axis=1)
+
+def per_example_gradients(model: tf.keras.Model,
+                          inputs: np.ndarray,
+                          targets: np.ndarray = None,
+                          loss='mean_absolute_error',
+                          batch_size: int = 1000):
+    """Compute the gradient of every example w.r.t. all trainable parameters of a model.
+
+    SplineANN, ABELSpline and LookupTableModel gradients only touch a few control points per example,
+    so they are assembled directly from the spline basis or cell index as a sparse matrix. All other
+    models fall back to a dense vectorized jacobian.
+
+    Args:
+        model: The model to differentiate.
+        inputs: The examples, shape [num_examples, input_dim].
+        targets: The targets of the examples. If None, the gradients of the (summed) model output are returned
+            instead of the gradients of the loss. Defaults to None.
+        loss: The loss identifier. Defaults to 'mean_absolute_error'.
+        batch_size: Number of examples differentiated at once. Defaults to 1000.
+
+    Returns:
+        A scipy.sparse.csr_matrix for the spline and lookup table models, otherwise a numpy array,
+        of shape [num_examples, num_parameters].
+    """
+    inputs = tf.constant(inputs, dtype=tf.float32)
+    batches = []
+    for start in range(0, len(inputs), batch_size):
+        batch_inputs = inputs[start:start + batch_size]
+        batch_targets = None if targets is None else targets[start:start + batch_size]
+        if hasattr(model, 'spline_basis'):
+            batches.append(_spline_ann_gradients(model, batch_inputs, _output_gradients(model, batch_inputs, batch_targets, loss)))
+        elif hasattr(model, 'direct_sam'):
+            batches.append(_abel_spline_gradients(model, batch_inputs, _output_gradients(model, batch_inputs, batch_targets, loss)))
+        elif hasattr(model, 'cell_indices'):
+            batches.append(_lookup_table_gradients(model, batch_inputs, _output_gradients(model, batch_inputs, batch_targets, loss)))
+        else:
+            batches.append(_dense_gradients(model, batch_inputs, batch_targets, loss))
+    if scipy.sparse.issparse(batches[0]):
+        return scipy.sparse.vstack(batches, format='csr')
+    return np.concatenate(batches, axis=0)
+
+def _row_norms(gradients) -> np.ndarray:
+    """Euclidean norm of every row of a dense or sparse gradient matrix."""
+    if scipy.sparse.issparse(gradients):
+        return np.sqrt(np.asarray(gradients.multiply(gradients).sum(axis=1)).ravel())
+    return np.linalg.norm(gradients, axis=1)
+
+def gradient_overlap(gradients, other_gradients=None, normalize: bool = True) -> np.ndarray:
+    """Compute the pairwise inner products of per-example gradients.
+
+    Args:
+        gradients: Per-example gradients, as returned by per_example_gradients.
+        other_gradients: Optional second set of per-example gradients of the same model. Defaults to gradients.
+        normalize: Return cosine similarities instead of raw inner products. Defaults to True.
+
+    Returns:
+        A dense array of shape [len(gradients), len(other_gradients)].
+    """
+    if other_gradients is None:
+        other_gradients = gradients
+    overlap = gradients @ other_gradients.T
+    overlap = overlap.toarray() if scipy.sparse.issparse(overlap) else np.asarray(overlap)
+    if normalize:
+        norms = np.outer(_row_norms(gradients), _row_norms(other_gradients))
+        overlap = overlap / np.maximum(norms, np.finfo(np.float32).tiny)
+    return overlap